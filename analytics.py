@@ -0,0 +1,136 @@
+import asyncio
+import datetime
+import logging
+
+from sqlalchemy import and_
+from sqlalchemy.dialects.postgresql import insert
+
+from database import db, Sales, SalesDaily, now
+from models import InvoiceState, OrderBriefResponse, OrderContentBrief
+from orders import OrderCache
+
+
+logger = logging.getLogger(__name__)
+
+
+ROLLUP_COLUMNS = ('orders', 'refunds', 'amount', 'refunded_amount', 'profit', 'revenue_rub', 'revenue_usd',
+                  'revenue_eur')
+
+
+class SalesRollup:
+    """
+    Дневная статистика продаж по товарам. Каждый заказ учитывается один раз: запись в sales
+    хранит, что уже прибавлено к sales_daily, в сводку идет только разница (новый заказ или возврат).
+    Заказ учитывается сразу после оплаты, поэтому возвраты ищет отдельная перепроверка: раз в interval секунд
+    до batch невозвращенных продаж за последние window_days дней, давно не проверенные первыми
+    """
+
+    def __init__(self, orders: OrderCache, interval: float = 600, window_days: int = 14, batch: int = 100):
+        self.orders = orders
+        self.interval = interval
+        self.window_days = window_days
+        self.batch = batch
+        self.task: asyncio.Task = None
+        self.recorded = 0
+        self.refunds = 0
+        self.rechecked = 0
+
+    @staticmethod
+    def sale_day(order: OrderContentBrief) -> datetime.date:
+        # День по московскому времени, как и остальные даты сервиса
+        return order.purchase_date.astimezone(now().tzinfo).date()
+
+    async def record(self, invoice_id: int, order: OrderContentBrief,
+                     prices: tuple[float | None, float | None, float | None]) -> bool:
+        """Учитывает заказ в статистике. False, если сводка не изменилась"""
+        refunded = order.invoice_state == InvoiceState.RETURNED
+        price_rub, price_usd, price_eur = prices
+        async with db.transaction():
+            sale = await Sales.query.where(Sales.invoice_id == invoice_id).with_for_update().gino.first()
+            delta = dict.fromkeys(ROLLUP_COLUMNS, 0)
+            if sale is None:
+                sale = await Sales.create(
+                    invoice_id=invoice_id, product_id=order.item_id, day=self.sale_day(order),
+                    currency=order.currency_type, amount=order.amount, profit=order.profit, price_rub=price_rub,
+                    price_usd=price_usd, price_eur=price_eur, refunded=refunded, updated_at=now(),
+                )
+                delta.update(orders=1, amount=order.amount, profit=order.profit, revenue_rub=price_rub or 0,
+                             revenue_usd=price_usd or 0, revenue_eur=price_eur or 0)
+                self.recorded += 1
+            elif refunded and not sale.refunded:
+                await sale.update(refunded=True, updated_at=now()).apply()
+            else:
+                return False
+            if refunded:
+                delta.update(refunds=1, refunded_amount=sale.amount)
+                self.refunds += 1
+            stmt = insert(SalesDaily.__table__).values(
+                day=sale.day, product_id=sale.product_id, currency=sale.currency, **delta)
+            await stmt.on_conflict_do_update(
+                index_elements=['day', 'product_id', 'currency'],
+                set_={column: SalesDaily.__table__.c[column] + stmt.excluded[column] for column in ROLLUP_COLUMNS},
+            ).gino.status()
+        return True
+
+    async def recheck(self) -> int:
+        """Перечитывает недавние продажи из GGSel и учитывает возвраты, возвращает число проверенных"""
+        since = now().date() - datetime.timedelta(days=self.window_days)
+        # updated_at продажи - время последней проверки
+        rows = await Sales.query.where(and_(Sales.refunded.is_(False), Sales.day >= since)).order_by(
+            Sales.updated_at).limit(self.batch).gino.all()
+        for sale in rows:
+            try:
+                response = await self.orders.refresh(sale.invoice_id, projection=OrderBriefResponse)
+                if response.content is not None and response.content.invoice_state == InvoiceState.RETURNED:
+                    await self.record(sale.invoice_id, response.content, (None, None, None))
+                    continue
+            except Exception:
+                logger.exception('Failed to recheck sale %s', sale.invoice_id)
+            await sale.update(updated_at=now()).apply()
+        self.rechecked += len(rows)
+        return len(rows)
+
+    async def run(self):
+        while True:
+            try:
+                await self.recheck()
+            except Exception:
+                logger.exception('Failed to recheck sales')
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def daily(self, day: datetime.date) -> list[SalesDaily]:
+        return await SalesDaily.query.where(SalesDaily.day == day).order_by(
+            SalesDaily.product_id, SalesDaily.currency).gino.all()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'recorded': self.recorded,
+            'refunds': self.refunds,
+            'rechecked': self.rechecked,
+        }
+
+
+def format_daily(day: datetime.date, rows: list[SalesDaily]) -> str:
+    if not rows:
+        return f'📈 Продажи за {day:%d.%m.%Y}: пока нет'
+    text = f'📈 Продажи за {day:%d.%m.%Y}\n\n'
+    total_rub = 0
+    for row in rows:
+        text += (f'• {row.product_id}: {row.orders} шт., {row.amount:g} {row.currency}, '
+                 f'прибыль {row.profit:g}')
+        if row.refunds:
+            text += f', возвратов {row.refunds} на {row.refunded_amount:g}'
+        text += '\n'
+        total_rub += row.revenue_rub
+    text += f'\nИтого по ценам товаров: {total_rub:g} ₽'
+    return text
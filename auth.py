@@ -0,0 +1,114 @@
+import asyncio
+import datetime
+import logging
+import random
+from typing import Awaitable, Callable, TYPE_CHECKING
+
+from metrics import TOKEN_REFRESH_SUCCESS, TOKEN_REFRESH_FAILURE
+
+if TYPE_CHECKING:
+    from cluster import SharedToken
+
+
+logger = logging.getLogger(__name__)
+
+
+class TokenManager:
+    """
+    Токен сессии GGSel.
+    Обновляется в фоне за margin секунд до valid_thru, одновременные обновления объединяются в один логин,
+    неудачные попытки повторяются с экспоненциальной задержкой.
+    С store токен берется из общего хранилища, если его уже обновил другой процесс
+    """
+
+    def __init__(self, login: Callable[[], Awaitable[tuple[str, datetime.datetime]]], margin: float = 300,
+                 retry_delay: float = 1, max_retry_delay: float = 60, store: 'SharedToken' = None):
+        self.login = login
+        self.store = store
+        self.margin = margin
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.token: str = None
+        self.valid_thru: datetime.datetime = None
+        self.refreshing: asyncio.Task = None
+        self.task: asyncio.Task = None
+        self.refreshes = 0
+        self.failures = 0
+
+    def seconds_left(self) -> float:
+        if self.token is None:
+            return 0
+        now = datetime.datetime.now(datetime.timezone.utc)
+        return (self.valid_thru - now).total_seconds() - self.margin
+
+    def expired(self) -> bool:
+        return self.token is None or self.valid_thru <= datetime.datetime.now(datetime.timezone.utc)
+
+    async def get(self) -> str:
+        # Внутри margin токен обновляет run() в фоне, запросы до valid_thru идут со старым.
+        # Ждать логина приходится, только если токена нет или он уже истек
+        if self.expired():
+            return await self.refresh()
+        return self.token
+
+    async def refresh(self, stale: str = None) -> str:
+        # stale - токен, который отклонил сервер. Если его уже заменили, повторно не логинимся
+        if stale is not None and self.token != stale:
+            return self.token
+        if self.refreshing is None:
+            self.refreshing = asyncio.ensure_future(self._refresh())
+        return await asyncio.shield(self.refreshing)
+
+    async def _refresh(self) -> str:
+        try:
+            if self.store is not None:
+                token, valid_thru = await self.store.refresh(self.login, self.token, self.margin)
+            else:
+                token, valid_thru = await self.login()
+        except Exception:
+            self.failures += 1
+            TOKEN_REFRESH_FAILURE.inc()
+            raise
+        finally:
+            self.refreshing = None
+        self.token, self.valid_thru = token, valid_thru
+        self.refreshes += 1
+        TOKEN_REFRESH_SUCCESS.inc()
+        return token
+
+    async def run(self):
+        delay = self.retry_delay
+        while True:
+            left = self.seconds_left()
+            if left > 0:
+                await asyncio.sleep(left)
+                # Токен могли обновить по 401, пока мы спали
+                if self.seconds_left() > 0:
+                    continue
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception('Failed to refresh GGSel token, retry in %.0f s', delay)
+                await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+                delay = min(delay * 2, self.max_retry_delay)
+                continue
+            delay = self.retry_delay
+            if self.seconds_left() <= 0:
+                # Токен живет меньше margin, не логинимся чаще раза в секунду
+                await asyncio.sleep(1)
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'refreshes': self.refreshes,
+            'failures': self.failures,
+        }
@@ -0,0 +1,68 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class Batcher:
+    """
+    Собирает ключи, запрошенные в течение короткого окна (delay секунд или один тик цикла при delay=0),
+    и загружает их одним вызовом load_many. load_many возвращает словарь ключ -> значение,
+    ключи без значения получают None
+    """
+
+    def __init__(self, load_many: Callable[[list], Awaitable[dict]], delay: float = 0.005, max_batch: int = 100):
+        self.load_many = load_many
+        self.delay = delay
+        self.max_batch = max_batch
+        self.pending: dict[Hashable, asyncio.Future] = {}
+        self.handle: asyncio.Handle = None
+        self.running: set[asyncio.Task] = set()
+        self.batches = 0
+        self.keys = 0
+
+    async def load(self, key: Hashable) -> Any:
+        future = self.pending.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self.pending[key] = future
+            if len(self.pending) >= self.max_batch:
+                self.dispatch()
+            elif self.handle is None:
+                if self.delay > 0:
+                    self.handle = loop.call_later(self.delay, self.dispatch)
+                else:
+                    self.handle = loop.call_soon(self.dispatch)
+        return await asyncio.shield(future)
+
+    def dispatch(self):
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+        batch, self.pending = self.pending, {}
+        if not batch:
+            return
+        task = asyncio.ensure_future(self._run(batch))
+        self.running.add(task)
+        task.add_done_callback(self.running.discard)
+
+    async def _run(self, batch: dict[Hashable, asyncio.Future]):
+        self.batches += 1
+        self.keys += len(batch)
+        try:
+            results = await self.load_many(list(batch))
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+                    # Исключение могли уже не ждать (все вызывающие отменены)
+                    future.add_done_callback(lambda f: f.exception())
+            return
+        for key, future in batch.items():
+            if not future.done():
+                future.set_result(results.get(key))
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'batches': self.batches,
+            'keys': self.keys,
+        }
@@ -0,0 +1,102 @@
+"""
+Circuit breaker scenarios of GGSel.request against a local server that answers with a scripted
+sequence of statuses and then recovers. Prints the breaker state after each call and exits with 1
+if the breaker does not close again once the upstream answers 200.
+
+    python -m benchmarks.breaker
+"""
+import asyncio
+import sys
+
+from aiohttp import web
+
+from ggsel import GGSel
+from resilience import CircuitBreaker, CircuitOpenError, UpstreamError
+from benchmarks.fixtures import login, product_info
+
+RESET_TIMEOUT = 0.05
+
+# Ответы сервера по порядку, дальше upstream восстановился и отвечает 200.
+# В каждом сценарии цепь должна замкнуться, разомкнувшись ожидаемое число раз
+SCENARIOS = {
+    'probe succeeds': ([500, 500], 1),
+    'probe fails': ([500, 500, 500], 2),
+    'probe throttled': ([500, 500, 429], 1),
+}
+
+
+class ScriptedServer:
+    def __init__(self):
+        self.statuses: list[int] = []
+        self.runner: web.AppRunner = None
+
+    async def product(self, request: web.Request) -> web.Response:
+        status = self.statuses.pop(0) if self.statuses else 200
+        if status != 200:
+            return web.Response(status=status, text='scripted', headers={'Retry-After': '0'})
+        return web.json_response(product_info(int(request.match_info['product_id'])))
+
+    async def login(self, request: web.Request) -> web.Response:
+        return web.json_response(login())
+
+    async def start(self) -> str:
+        app = web.Application()
+        app.router.add_post('/api_sellers/api/apilogin', self.login)
+        app.router.add_get('/api_sellers/api/products/{product_id}/data', self.product)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        return f'http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}'
+
+
+async def call(ggsel: GGSel) -> str:
+    try:
+        await ggsel.request('GET', '/api_sellers/api/products/1/data')
+    except UpstreamError as e:
+        return str(e.status)
+    except CircuitOpenError:
+        return 'rejected'
+    return '200'
+
+
+async def run_scenario(base_url: str, server: ScriptedServer, statuses: list[int]) -> GGSel:
+    ggsel = GGSel('token', 1, base_url=base_url, rate=1e6, breaker_threshold=2,
+                  breaker_reset_timeout=RESET_TIMEOUT)
+    await ggsel.open()
+    await ggsel.connect()
+    server.statuses = list(statuses)
+    trail = []
+    try:
+        # Каждый ответ из сценария и еще несколько вызовов после восстановления upstream
+        for _ in range(len(statuses) + 3):
+            result = await call(ggsel)
+            trail.append(f'{result}->{ggsel.breaker.state}')
+            if ggsel.breaker.state == CircuitBreaker.OPEN:
+                await asyncio.sleep(RESET_TIMEOUT * 1.5)
+            if result == '200' and not server.statuses:
+                break
+    finally:
+        await ggsel.close()
+    print('  ' + ', '.join(trail))
+    return ggsel
+
+
+async def main() -> int:
+    server = ScriptedServer()
+    base_url = await server.start()
+    failed = 0
+    try:
+        for name, (statuses, opened) in SCENARIOS.items():
+            print(f'{name}: {statuses}, then 200')
+            ggsel = await run_scenario(base_url, server, statuses)
+            ok = ggsel.breaker.state == CircuitBreaker.CLOSED and ggsel.breaker.opened == opened
+            failed += not ok
+            print(f'  {"ok" if ok else "FAILED"}: state {ggsel.breaker.state}, opened {ggsel.breaker.opened} times')
+    finally:
+        await server.runner.cleanup()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main()))
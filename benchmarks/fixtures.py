@@ -0,0 +1,157 @@
+# Sample GGSel payloads for the local stand-in servers used by the benchmarks
+import datetime
+
+
+def login(lifetime: float = 3600) -> dict:
+    valid_thru = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=lifetime)
+    # GGSel returns 7 fractional digits and a Z suffix
+    return {
+        'retval': 0,
+        'token': 'stand-in-token',
+        'valid_thru': valid_thru.strftime('%Y-%m-%dT%H:%M:%S.%f') + '0Z',
+    }
+
+
+def product_info(product_id: int) -> dict:
+    return {
+        'retval': 0,
+        'retdesc': '',
+        'product': {
+            'id': product_id,
+            'name': f'Clash Royale — Pass Royale #{product_id}',
+            'price': 499.0,
+            'currency': 'RUB',
+            'url': f'https://ggsel.net/catalog/product/{product_id}',
+            'info': '<p>Описание товара</p>' * 50,
+            'add_info': '<p>Дополнительная информация</p>' * 20,
+            'release_date': '2024-01-01T00:00:00.000Z',
+            'agency_fee': '0',
+            'collection': 'digi',
+            'propertygood': 1,
+            'is_available': 1,
+            'show_rest': 0,
+            'prices': {
+                'initial': {'RUB': 499.0, 'USD': 5.5, 'EUR': 5.1},
+                'default': {'RUB': 499.0, 'USD': 5.5, 'EUR': 5.1},
+            },
+            'payment_methods': ['card', 'sbp'],
+            'preview_imgs': [{'url': f'https://img.ggsel.net/{i}.png', 'width': 600, 'height': 400}
+                             for i in range(8)],
+            'preview_videos': [],
+            'category_id': 10,
+            'breadcrumbs': [{'id': 1, 'name': 'Игры'}, {'id': 10, 'name': 'Clash Royale'}],
+            'options': [
+                {
+                    'name': 1,
+                    'label': 'Почта Supercell ID',
+                    'type': 'text',
+                    'required': 1,
+                    'variants': [],
+                },
+                {
+                    'name': 2,
+                    'label': 'Регион',
+                    'type': 'radio',
+                    'required': 1,
+                    'variants': [{'value': v, 'text': f'Регион {v}', 'default': int(v == 1), 'visible': 1}
+                                 for v in range(1, 6)],
+                },
+            ],
+            'options_check': 1,
+            'statistics': {'sales': 1000, 'refunds': 3, 'good_reviews': 500, 'bad_reviews': 2},
+            'seller': {'id': 1, 'name': 'seller'},
+            'sale_info': {'common_base_price': 499.0, 'common_price_usd': 5.5,
+                          'common_price_rur': 499.0, 'common_price_eur': 5.1},
+            'num_in_stock': 100,
+        }
+    }
+
+
+def product_row(product_id: int) -> dict:
+    return {
+        'price': 499.0,
+        'currency': 'RUB',
+        'cnt_sell': 1000,
+        'cnt_return': 3,
+        'cnt_goodresponses': 500,
+        'cnt_badresponses': 2,
+        'price_usd': 5.5,
+        'price_rur': 499.0,
+        'price_eur': 5.1,
+        'price_uah': 230.0,
+        'in_stock': 1,
+        'num_in_stock': 100,
+        'visible': 1,
+        'num_options': 2,
+        'sale_info': {'common_base_price': 499.0, 'common_price_usd': 5.5,
+                      'common_price_rur': 499.0, 'common_price_eur': 5.1},
+        'id_goods': product_id,
+        'name_goods': f'Clash Royale — Pass Royale #{product_id}',
+        'info_goods': '<p>Описание товара</p>' * 10,
+        'add_info': '',
+    }
+
+
+def products_list(ids: list[int], page: int = 1, count: int = 10, total_count: int = None) -> dict:
+    total_count = len(ids) if total_count is None else total_count
+    total_pages = max(1, -(-total_count // count))
+    return {
+        'retval': 0,
+        'retdesc': '',
+        'page': page,
+        'count': count,
+        'has_next_page': page < total_pages,
+        'has_previous_page': page > 1,
+        'total_count': total_count,
+        'total_pages': total_pages,
+        'rows': [product_row(product_id) for product_id in ids],
+    }
+
+
+def last_sales(sales: list[tuple[int, int]]) -> dict:
+    # sales: (invoice_id, product_id)
+    return {
+        'retval': 0,
+        'retdesc': '',
+        'sales': [
+            {
+                'invoice_id': invoice_id,
+                'date': '2026-01-01T12:00:00Z',
+                'product': {'id': product_id, 'name': f'Product #{product_id}',
+                            'price_rub': 499.0, 'price_usd': 5.5, 'price_eur': 5.1},
+            }
+            for invoice_id, product_id in sales
+        ],
+    }
+
+
+def order_info(invoice_id: int, product_id: int = 1, email: str = 'buyer@example.com', state: int = 3) -> dict:
+    return {
+        'retval': 0,
+        'retdesc': '',
+        'content': {
+            'item_id': product_id,
+            'content_id': invoice_id,
+            'cart_uid': None,
+            'name': f'Clash Royale — Pass Royale #{product_id}',
+            'amount': 499.0,
+            'currency_type': 'RUB',
+            'invoice_state': state,
+            'purchase_date': '2026-01-01T12:00:00Z',
+            'date_pay': '2026-01-01T12:00:05Z',
+            'agent_fee': 0.0,
+            'cnt_goods': 1,
+            'unique_code_state': {'state': 1, 'date_check': None, 'date_delivery': None,
+                                  'date_confirmed': None, 'date_refuted': None},
+            'options': [
+                {'id': 1, 'name': 'Почта Supercell ID', 'user_data': email, 'user_data_id': None},
+                {'id': 2, 'name': 'Регион', 'user_data': 'Регион 1', 'user_data_id': 1},
+            ],
+            'buyer_info': {'payment_method': 'card', 'account': 'buyer', 'email': email,
+                           'ip_address': '127.0.0.1', 'payment_aggregator': 'aggregator'},
+            'owner': 1,
+            'day_lock': 0,
+            'lock_state': 'free',
+            'profit': 450.0,
+        }
+    }
@@ -0,0 +1,199 @@
+"""
+Load test of /notification and /check with GGSel, the Bot API, nextcaptcha and Supercell ID
+replaced by the local stand-in (benchmarks/standin.py). Postgres is taken from DB_* in the
+environment or .env and should be a throwaway local database.
+
+    python -m benchmarks.loadtest --requests 2000 --concurrency 50 --latency 0.05 --error-rate 0.01
+    python -m benchmarks.loadtest --compare benchmarks/results/loadtest-20260101-120000.json
+
+Every run is saved as JSON to --out, --compare prints the difference with an earlier run.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import subprocess
+import time
+from pathlib import Path
+
+import httpx
+
+from benchmarks.standin import StandIn
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, round(q / 100 * len(values)) - 1))
+    return values[index]
+
+
+def notification_body(invoice_id: int, product_id: int) -> dict:
+    return {
+        'id_i': invoice_id,
+        'id_d': product_id,
+        'amount': 499.0,
+        'currency': 'RUB',
+        'email': 'buyer@example.com',
+        'date': '2026-01-01 12:00:00',
+        'ip': '127.0.0.1',
+        'SHA256': '0' * 64,
+        'is_my_product': True,
+    }
+
+
+def check_body(product_id: int) -> dict:
+    return {
+        'product': {'id': product_id, 'cnt': 1, 'lang': 'ru-RU'},
+        'options': [{'id': 1, 'type': 'text', 'value': 'buyer@example.com'},
+                    {'id': 2, 'type': 'radio', 'value': 1}],
+    }
+
+
+def configure(url: str):
+    # Конфиг читается при импорте main, поэтому окружение выставляется до него
+    os.environ.update({
+        'GGSEL_BASE_URL': url,
+        'TELEGRAM_API_URL': url,
+        'CAPTCHA_API_URL': url,
+        'SUPERCELL_ID_URL': url,
+    })
+    for key, value in {'TELEGRAM_TOKEN': '1:stand-in', 'ADMIN_ID': '1', 'GGSEL_TOKEN': 'stand-in',
+                       'SELLER_ID': '1', 'CAPTCHA_TOKEN': 'stand-in', 'PROXY_IP': '127.0.0.1',
+                       'PROXY_PORT': '1080', 'PROXY_USER': 'user', 'PROXY_PASSWORD': 'password',
+                       'PROXY_TYPE': 'socks5',
+                       # Заказы прошлых прогонов остаются в базе, без этого /notification упрется в 503
+                       'JOB_MAX_BACKLOG': '1000000'}.items():
+        os.environ.setdefault(key, value)
+
+
+async def run_load(client: httpx.AsyncClient, requests: int, concurrency: int, check_ratio: float,
+                   products: int) -> dict[str, dict]:
+    # Уникальные id_i, чтобы повторный запуск не упирался в дедупликацию
+    invoice_base = int(time.time() * 1000) * 1000
+    plan = []
+    for i in range(requests):
+        product_id = random.randint(1, products)
+        if random.random() < check_ratio:
+            plan.append(('/check', check_body(product_id)))
+        else:
+            plan.append(('/notification', notification_body(invoice_base + i, product_id)))
+    plan.reverse()
+
+    latencies: dict[str, list[float]] = {'/check': [], '/notification': []}
+    errors: dict[str, int] = {'/check': 0, '/notification': 0}
+
+    async def worker():
+        while plan:
+            route, body = plan.pop()
+            start = time.perf_counter()
+            try:
+                response = await client.post(route, json=body)
+                failed = response.status_code >= 500
+            except Exception:
+                failed = True
+            latencies[route].append((time.perf_counter() - start) * 1000)
+            if failed:
+                errors[route] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    results = {}
+    for route, values in latencies.items():
+        values.sort()
+        results[route] = {
+            'requests': len(values),
+            'errors': errors[route],
+            'rps': len(values) / elapsed,
+            'p50_ms': percentile(values, 50),
+            'p95_ms': percentile(values, 95),
+            'p99_ms': percentile(values, 99),
+        }
+    results['total'] = {'requests': requests, 'elapsed_s': elapsed, 'rps': requests / elapsed}
+    return results
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ''
+
+
+def report(results: dict[str, dict]):
+    print(f'{"route":<16}{"requests":>10}{"errors":>8}{"rps":>10}{"p50, ms":>10}{"p95, ms":>10}{"p99, ms":>10}')
+    for route in ('/notification', '/check'):
+        r = results[route]
+        print(f'{route:<16}{r["requests"]:>10}{r["errors"]:>8}{r["rps"]:>10.1f}'
+              f'{r["p50_ms"]:>10.2f}{r["p95_ms"]:>10.2f}{r["p99_ms"]:>10.2f}')
+    print(f'total {results["total"]["requests"]} requests in {results["total"]["elapsed_s"]:.2f} s, '
+          f'{results["total"]["rps"]:.1f} rps')
+
+
+def compare(current: dict, previous: dict):
+    print(f'\ncompared with {previous["revision"]} at {previous["started_at"]}')
+    for route in ('/notification', '/check'):
+        for metric in ('rps', 'p50_ms', 'p95_ms', 'p99_ms'):
+            old, new = previous['results'][route][metric], current['results'][route][metric]
+            change = (new - old) / old * 100 if old else 0.0
+            print(f'{route:<16}{metric:<8}{old:>10.2f} -> {new:>10.2f} ({change:+.1f}%)')
+
+
+async def wait_ready(client: httpx.AsyncClient, timeout: float = 30):
+    # Сервис поднимает базу и токен в фоне после старта
+    deadline = time.perf_counter() + timeout
+    while (response := await client.get('/readyz')).status_code != 200:
+        if time.perf_counter() > deadline:
+            raise RuntimeError(f'Service is not ready: {response.text}')
+        await asyncio.sleep(0.05)
+
+
+async def main(args: argparse.Namespace):
+    standin = StandIn(args.latency, args.jitter, args.error_rate)
+    configure(await standin.start())
+    import main as service
+
+    started_at = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+    transport = httpx.ASGITransport(app=service.app)
+    try:
+        async with service.app.router.lifespan_context(service.app):
+            async with httpx.AsyncClient(transport=transport, base_url='http://service', timeout=60) as client:
+                await wait_ready(client)
+                results = await run_load(client, args.requests, args.concurrency, args.check_ratio, args.products)
+    finally:
+        await standin.stop()
+
+    run = {
+        'revision': git_revision(),
+        'started_at': started_at,
+        'params': {key: value for key, value in vars(args).items() if key not in ('out', 'compare')},
+        'results': results,
+        'upstream_calls': standin.calls,
+    }
+    report(results)
+    out = Path(args.out)
+    out.mkdir(parents=True, exist_ok=True)
+    path = out / f'loadtest-{started_at}.json'
+    path.write_text(json.dumps(run, indent=2, ensure_ascii=False))
+    print(f'saved to {path}')
+    if args.compare:
+        compare(run, json.loads(Path(args.compare).read_text()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--check-ratio', type=float, default=0.5)
+    parser.add_argument('--products', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--out', default='benchmarks/results')
+    parser.add_argument('--compare')
+    args = parser.parse_args()
+    asyncio.run(main(args))
@@ -0,0 +1,85 @@
+"""
+Throughput of the Telegram Notifier against a fake Bot that enforces flood limits
+and answers with retry_after like the Bot API does.
+
+    python -m benchmarks.notifier --chats 20 --messages 10 --admin-burst 100
+"""
+import argparse
+import asyncio
+import time
+from collections import defaultdict, deque
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from notifier import Notifier
+
+
+ADMIN_ID = 1
+
+
+class FakeBot:
+    """Bot API stand-in: sliding one-second windows per chat and for the whole bot"""
+
+    def __init__(self, latency: float, chat_limit: int, global_limit: int):
+        self.latency = latency
+        self.chat_limit = chat_limit
+        self.global_limit = global_limit
+        self.chat_sent: dict[int, deque[float]] = defaultdict(deque)
+        self.global_sent: deque[float] = deque()
+        self.delivered: dict[int, list[str]] = defaultdict(list)
+        self.flood_errors = 0
+
+    @staticmethod
+    def in_window(sent: deque[float], now: float) -> int:
+        # Small tolerance for event loop timer jitter
+        while sent and sent[0] <= now - 0.95:
+            sent.popleft()
+        return len(sent)
+
+    async def send_message(self, chat_id: int, text: str):
+        await asyncio.sleep(self.latency)
+        now = time.monotonic()
+        if (self.in_window(self.chat_sent[chat_id], now) >= self.chat_limit
+                or self.in_window(self.global_sent, now) >= self.global_limit):
+            self.flood_errors += 1
+            raise TelegramRetryAfter(SendMessage(chat_id=chat_id, text=text), 'Flood control exceeded',
+                                     retry_after=1)
+        self.chat_sent[chat_id].append(now)
+        self.global_sent.append(now)
+        self.delivered[chat_id].append(text)
+
+
+async def main(chats: int, messages: int, admin_burst: int, latency: float):
+    bot = FakeBot(latency, chat_limit=1, global_limit=30)
+    notifier = Notifier(bot, per_chat_rate=1, per_chat_burst=1, global_rate=25, digest_chat_id=ADMIN_ID)
+    start = time.perf_counter()
+    for i in range(admin_burst):
+        notifier.send(ADMIN_ID, f'admin message {i}')
+    for n in range(messages):
+        for chat_id in range(100, 100 + chats):
+            notifier.send(chat_id, f'message {n}')
+    await notifier.close(timeout=600)
+    elapsed = time.perf_counter() - start
+
+    ordered = all(bot.delivered[chat_id] == [f'message {n}' for n in range(messages)]
+                  for chat_id in range(100, 100 + chats))
+    total = chats * messages + admin_burst
+    print(f'queued messages   {total}')
+    print(f'telegram calls    {sum(len(texts) for texts in bot.delivered.values())}')
+    print(f'admin digests     {notifier.digests}')
+    print(f'flood errors      {bot.flood_errors}')
+    print(f'per-chat order    {"kept" if ordered else "BROKEN"}')
+    print(f'elapsed           {elapsed:.2f} s')
+    print(f'throughput        {total / elapsed:.1f} queued messages/s')
+    print(notifier.stats())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chats', type=int, default=20)
+    parser.add_argument('--messages', type=int, default=5)
+    parser.add_argument('--admin-burst', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.03)
+    args = parser.parse_args()
+    asyncio.run(main(args.chats, args.messages, args.admin_burst, args.latency))
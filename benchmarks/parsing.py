@@ -0,0 +1,52 @@
+"""
+CPU time and peak memory of parsing GGSel responses into the full models
+against the projection models.
+
+    python -m benchmarks.parsing --iterations 2000
+"""
+import argparse
+import json
+import time
+import tracemalloc
+
+from pydantic import BaseModel
+
+from benchmarks.fixtures import order_info, product_info, products_list
+from models import (ProductInfoResponse, ProductBriefResponse, OrderInfoResponse, OrderBriefResponse,
+                    ProductsAllResponse, ProductsBriefResponse)
+
+
+def measure(model: type[BaseModel], payload: str, iterations: int) -> tuple[float, int]:
+    start = time.process_time()
+    for _ in range(iterations):
+        model.model_validate_json(payload)
+    cpu = (time.process_time() - start) / iterations * 1e6
+
+    # Пиковая память одного разбора вместе с получившимся объектом
+    tracemalloc.start()
+    result = model.model_validate_json(payload)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return cpu, peak
+
+
+def main(iterations: int):
+    cases = [
+        ('product info', json.dumps(product_info(1)), ProductInfoResponse, ProductBriefResponse),
+        ('order info', json.dumps(order_info(1)), OrderInfoResponse, OrderBriefResponse),
+        ('products list x100', json.dumps(products_list(list(range(1, 101)), count=100)),
+         ProductsAllResponse, ProductsBriefResponse),
+    ]
+    print(f'{"payload":<20}{"model":<24}{"cpu, us":>10}{"peak, KiB":>12}')
+    for name, payload, full, projection in cases:
+        for model in (full, projection):
+            cpu, peak = measure(model, payload, iterations)
+            print(f'{name:<20}{model.__name__:<24}{cpu:>10.1f}{peak / 1024:>12.1f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+    main(args.iterations)
@@ -0,0 +1,83 @@
+"""
+Per-request latency of GGSel.request with a new ClientSession per call (the old behaviour)
+against the pooled session, measured on a local stand-in server.
+
+    python -m benchmarks.session --requests 500
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from aiohttp import ClientSession, web
+
+from ggsel import GGSel, HEADERS
+from benchmarks.fixtures import login, product_info
+
+
+async def product_handler(request: web.Request) -> web.Response:
+    return web.json_response(product_info(int(request.match_info['product_id'])))
+
+
+async def login_handler(request: web.Request) -> web.Response:
+    return web.json_response(login())
+
+
+async def start_server() -> tuple[web.AppRunner, str]:
+    app = web.Application()
+    app.router.add_post('/api_sellers/api/apilogin', login_handler)
+    app.router.add_get('/api_sellers/api/products/{product_id}/data', product_handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f'http://127.0.0.1:{port}'
+
+
+async def request_new_session(base_url: str, url: str, params: dict) -> str:
+    async with ClientSession() as session:
+        response = await session.request('GET', base_url + url, params=params, headers=HEADERS)
+        return await response.text()
+
+
+async def measure(call, count: int) -> list[float]:
+    timings = []
+    for i in range(count):
+        start = time.perf_counter()
+        await call(i)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def report(name: str, timings: list[float]):
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f'{name:<14} mean {statistics.mean(timings):7.3f} ms   '
+          f'p50 {statistics.median(timings):7.3f} ms   p95 {p95:7.3f} ms')
+
+
+async def main(count: int):
+    runner, base_url = await start_server()
+    # Лимиты клиента выше любой нагрузки бенчмарка: меряем переиспользование соединений, а не ограничитель
+    ggsel = GGSel('token', 1, base_url=base_url, rate=1e6, max_concurrency=1000)
+    try:
+        new_session = await measure(
+            lambda i: request_new_session(base_url, f'/api_sellers/api/products/{i}/data', {'token': 'token'}),
+            count)
+        await ggsel.open()
+        await ggsel.connect()
+        pooled = await measure(
+            lambda i: ggsel.request('GET', f'/api_sellers/api/products/{i}/data'), count)
+    finally:
+        await ggsel.close()
+        await runner.cleanup()
+    report('new session', new_session)
+    report('pooled', pooled)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=500)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests))
@@ -0,0 +1,130 @@
+"""
+Local stand-in for GGSel, the Telegram Bot API, nextcaptcha and Supercell ID with configurable
+latency and error injection. Used by the load test, can also be started on its own:
+
+    python -m benchmarks.standin --port 8900 --latency 0.05 --error-rate 0.01
+"""
+import argparse
+import asyncio
+import itertools
+import random
+import time
+
+from aiohttp import web
+
+from benchmarks import fixtures
+
+
+class StandIn:
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.calls: dict[str, int] = {}
+        self.errors = 0
+        self.message_ids = itertools.count(1)
+        self.runner: web.AppRunner = None
+        self.url: str = None
+
+    def app(self) -> web.Application:
+        app = web.Application(middlewares=[self.middleware])
+        app.router.add_post('/api_sellers/api/apilogin', self.apilogin)
+        app.router.add_get('/api_sellers/api/products/list', self.products_list)
+        app.router.add_get('/api_sellers/api/products/{product_id}/data', self.product_info)
+        app.router.add_get('/api_sellers/api/purchase/info/{invoice_id}', self.order_info)
+        app.router.add_get('/api_sellers/api/seller-last-sales', self.last_sales)
+        app.router.add_post('/api_sellers/api/debates/v2', self.debates)
+        app.router.add_post('/bot{token}/{method}', self.bot_api)
+        app.router.add_post('/createTask', self.create_task)
+        app.router.add_post('/getTaskResult', self.task_result)
+        app.router.add_post('/api/account/v2/pinAuthentication.start', self.pin_authentication)
+        return app
+
+    @web.middleware
+    async def middleware(self, request: web.Request, handler):
+        route = request.match_info.route.resource.canonical if request.match_info.route.resource else request.path
+        self.calls[route] = self.calls.get(route, 0) + 1
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        # Логин не ломаем, иначе тест меряет только TokenManager
+        if self.error_rate and route != '/api_sellers/api/apilogin' and random.random() < self.error_rate:
+            self.errors += 1
+            return web.Response(status=503, text='injected error')
+        return await handler(request)
+
+    async def apilogin(self, request: web.Request) -> web.Response:
+        return web.json_response(fixtures.login())
+
+    async def products_list(self, request: web.Request) -> web.Response:
+        ids = [int(product_id) for product_id in request.query.get('ids', '').split(',') if product_id]
+        count = int(request.query.get('count', 10))
+        page = int(request.query.get('page', 1))
+        if not ids:
+            ids = list(range((page - 1) * count + 1, page * count + 1))
+        return web.json_response(fixtures.products_list(ids, page=page, count=count))
+
+    async def product_info(self, request: web.Request) -> web.Response:
+        return web.json_response(fixtures.product_info(int(request.match_info['product_id'])))
+
+    async def order_info(self, request: web.Request) -> web.Response:
+        return web.json_response(fixtures.order_info(int(request.match_info['invoice_id'])))
+
+    async def last_sales(self, request: web.Request) -> web.Response:
+        return web.json_response(fixtures.last_sales([]))
+
+    async def debates(self, request: web.Request) -> web.Response:
+        return web.json_response({'retval': 0, 'retdesc': ''})
+
+    async def bot_api(self, request: web.Request) -> web.Response:
+        data = await request.post()
+        result = {
+            'message_id': next(self.message_ids),
+            'date': int(time.time()),
+            'chat': {'id': int(data.get('chat_id', 0)), 'type': 'private'},
+            'text': data.get('text', ''),
+        }
+        return web.json_response({'ok': True, 'result': result})
+
+    async def create_task(self, request: web.Request) -> web.Response:
+        return web.json_response({'errorId': 0, 'taskId': 1})
+
+    async def task_result(self, request: web.Request) -> web.Response:
+        return web.json_response({'errorId': 0, 'status': 'ready',
+                                  'solution': {'gRecaptchaResponse': 'stand-in-captcha'}})
+
+    async def pin_authentication(self, request: web.Request) -> web.Response:
+        return web.json_response({'ok': True})
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        self.runner = web.AppRunner(self.app(), access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f'http://{host}:{port}'
+        return self.url
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+
+async def serve(port: int, latency: float, jitter: float, error_rate: float):
+    standin = StandIn(latency, jitter, error_rate)
+    print(f'Stand-in listening on {await standin.start(port=port)}')
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await standin.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    asyncio.run(serve(args.port, args.latency, args.jitter, args.error_rate))
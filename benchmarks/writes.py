@@ -0,0 +1,97 @@
+"""
+Rows/sec of invoice writes: one INSERT ... ON CONFLICT and one UPDATE per event (the old JobQueue path)
+against InvoiceWriter batches. Needs a local Postgres from DB_* in the environment or .env;
+the benchmark writes negative invoice ids and deletes them afterwards.
+
+    python -m benchmarks.writes --rows 5000 --concurrency 50
+"""
+import argparse
+import asyncio
+import time
+
+from sqlalchemy.dialects.postgresql import insert
+
+from database import db, connect, create_schema, Invoices, InvoiceStatus, InvoiceWriter, now
+
+
+async def per_row_insert(invoice_id: int):
+    await db.scalar(insert(Invoices.__table__).values(
+        invoice_id=invoice_id,
+        item_id=1,
+        status=InvoiceStatus.NEW,
+        created_at=now(),
+        sent=False,
+    ).on_conflict_do_nothing(index_elements=['invoice_id']).returning(Invoices.id))
+
+
+async def per_row_update(invoice_id: int):
+    await Invoices.update.values(status=InvoiceStatus.DONE, sent=True).where(
+        Invoices.invoice_id == invoice_id).gino.status()
+
+
+async def buffered_insert(writer: InvoiceWriter, invoice_id: int):
+    writer.add(invoice_id, 1)
+    # Как между обработчиками запросов: даем циклу событий запустить запись пачки по размеру
+    await asyncio.sleep(0)
+
+
+async def buffered_update(writer: InvoiceWriter, invoice_id: int):
+    writer.update(invoice_id, InvoiceStatus.DONE, True)
+    await asyncio.sleep(0)
+
+
+async def run(call, ids: list[int], concurrency: int) -> float:
+    queue = iter(ids)
+
+    async def worker():
+        for invoice_id in queue:
+            await call(invoice_id)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - start
+
+
+async def cleanup():
+    await db.status(db.text('DELETE FROM invoices WHERE invoice_id < 0'))
+
+
+def report(name: str, rows: int, elapsed: float):
+    print(f'{name:<18} {rows / elapsed:10.0f} rows/s   {elapsed * 1000:8.1f} ms')
+
+
+async def main(rows: int, concurrency: int, flush_rows: int, interval: float):
+    await connect()
+    await create_schema()
+    await cleanup()
+    try:
+        ids = [-i for i in range(1, rows + 1)]
+        report('per-row insert', rows, await run(per_row_insert, ids, concurrency))
+        report('per-row update', rows, await run(per_row_update, ids, concurrency))
+        await cleanup()
+
+        writer = InvoiceWriter(max_rows=flush_rows, interval=interval)
+        writer.start()
+        # Время считается до записи всего буфера, а не до постановки в него
+        elapsed = await run(lambda i: buffered_insert(writer, i), ids, concurrency)
+        start = time.perf_counter()
+        await writer.flush()
+        report('buffered insert', rows, elapsed + time.perf_counter() - start)
+        elapsed = await run(lambda i: buffered_update(writer, i), ids, concurrency)
+        start = time.perf_counter()
+        await writer.stop()
+        report('buffered update', rows, elapsed + time.perf_counter() - start)
+        print(f'flushes: {writer.flushes}, inserted: {writer.inserted}, updated: {writer.updated}')
+    finally:
+        await cleanup()
+        await db.pop_bind().close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--flush-rows', type=int, default=500)
+    parser.add_argument('--interval', type=float, default=0.05)
+    args = parser.parse_args()
+    asyncio.run(main(args.rows, args.concurrency, args.flush_rows, args.interval))
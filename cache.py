@@ -0,0 +1,99 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Ограниченный LRU-кэш с временем жизни записей.
+    get_or_load объединяет одновременные промахи по одному ключу в один запрос загрузки
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300, ttl_for: Callable[[Any], float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # Время жизни загруженного значения в зависимости от него самого, иначе ttl
+        self.ttl_for = ttl_for
+        self.data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self.loading: dict[Hashable, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self.data.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self.data[key]
+            return default
+        self.data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: float = None):
+        ttl = self.ttl if ttl is None else ttl
+        self.data[key] = (time.monotonic() + ttl, value)
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        self.data.pop(key, None)
+        # Результат уже идущей загрузки устарел, его не нужно класть в кэш
+        self.loading.pop(key, None)
+
+    def invalidate_matching(self, predicate: Callable[[Hashable], bool]):
+        for key in [key for key in (*self.data, *self.loading) if predicate(key)]:
+            self.invalidate(key)
+
+    def clear(self):
+        self.data.clear()
+        self.loading.clear()
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            self.hits += 1
+            return value
+        task = self.loading.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(self._load(key, loader))
+            task.add_done_callback(_consume_exception)
+            self.loading[key] = task
+        else:
+            self.coalesced += 1
+        # shield: отмена одного из ожидающих не должна отменять загрузку для остальных
+        return await asyncio.shield(task)
+
+    async def _load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        task = asyncio.current_task()
+        try:
+            value = await loader()
+            if self.loading.get(key) is task:
+                self.set(key, value, self.ttl_for(value) if self.ttl_for is not None else None)
+            return value
+        finally:
+            if self.loading.get(key) is task:
+                del self.loading[key]
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'size': len(self.data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+        }
+
+
+def _consume_exception(task: asyncio.Task):
+    if not task.cancelled():
+        task.exception()
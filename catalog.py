@@ -0,0 +1,117 @@
+import asyncio
+import hashlib
+import logging
+
+from sqlalchemy.dialects.postgresql import insert
+
+from database import db, connected, Products, now
+from ggsel import GGSel
+from models import ProductRowBrief, ProductsBriefResponse
+
+
+logger = logging.getLogger(__name__)
+
+
+def product_values(row: ProductRowBrief) -> dict:
+    try:
+        price = float(row.price)
+    except ValueError:
+        price = row.price_rur
+    values = {
+        'id': row.id_goods,
+        'name': row.name_goods,
+        'price': price,
+        'currency': row.currency,
+        'price_rub': row.price_rur,
+        'price_usd': row.price_usd,
+        'price_eur': row.price_eur,
+        'in_stock': row.in_stock,
+        'num_in_stock': row.num_in_stock,
+        'num_options': row.num_options,
+    }
+    values['row_hash'] = hashlib.md5(repr(sorted(values.items())).encode('utf-8')).hexdigest()
+    return values
+
+
+class Catalog:
+    """
+    Каталог товаров в Postgres. Полная синхронизация через products/list при старте,
+    дальше периодический обход, который перезаписывает только изменившиеся строки
+    """
+
+    def __init__(self, ggsel: GGSel, interval: float = 600, page_size: int = 50, concurrency: int = 4,
+                 batch_size: int = 500):
+        self.ggsel = ggsel
+        self.interval = interval
+        self.page_size = page_size
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.task: asyncio.Task = None
+        self.synced_at = None
+
+    async def get(self, product_id: int) -> Products | None:
+        if not connected():
+            return None
+        try:
+            return await Products.get(product_id)
+        except Exception:
+            # Без базы товар все равно можно получить из GGSel
+            logger.exception('Failed to read product %s from the catalog', product_id)
+            return None
+
+    async def store(self, rows: list[dict]):
+        rows = [{**values, 'updated_at': now()} for values in rows]
+        stmt = insert(Products.__table__).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['id'],
+            set_={column: stmt.excluded[column] for column in rows[0] if column != 'id'}
+        )
+        await db.status(stmt)
+
+    async def store_row(self, row: ProductRowBrief):
+        # Товар из ответа GGSel сохраняется попутно, ошибка записи не мешает заказу
+        if not connected():
+            return
+        try:
+            await self.store([product_values(row)])
+        except Exception:
+            logger.exception('Failed to store product %s in the catalog', row.id_goods)
+
+    async def sync(self) -> int:
+        hashes = dict(await db.select([Products.id, Products.row_hash]).gino.all())
+        changed = []
+        total = 0
+        async for row in self.ggsel.iter_all_products(count=self.page_size, concurrency=self.concurrency,
+                                                    projection=ProductsBriefResponse):
+            values = product_values(row)
+            if hashes.get(values['id']) == values['row_hash']:
+                continue
+            changed.append(values)
+            if len(changed) >= self.batch_size:
+                await self.store(changed)
+                total += len(changed)
+                changed = []
+        if changed:
+            await self.store(changed)
+            total += len(changed)
+        self.synced_at = now()
+        return total
+
+    async def run(self):
+        while True:
+            try:
+                changed = await self.sync()
+                logger.info('Catalog synced, %s products changed', changed)
+            except Exception:
+                logger.exception('Failed to sync catalog')
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
@@ -0,0 +1,166 @@
+import asyncio
+import datetime
+import hashlib
+import logging
+import random
+from typing import Awaitable, Callable
+
+from sqlalchemy.dialects.postgresql import insert
+
+from database import db, connected, Tokens, now
+
+
+logger = logging.getLogger(__name__)
+
+
+def advisory_key(name: str) -> int:
+    # Ключ pg_advisory_lock - знаковый bigint, одинаковый во всех процессах
+    return int.from_bytes(hashlib.sha256(name.encode('utf-8')).digest()[:8], 'big', signed=True)
+
+
+class SharedToken:
+    """
+    Токен, общий для процессов сервиса. Хранится в таблице tokens,
+    логинится только один процесс под advisory-блокировкой, остальные берут готовый токен из базы
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.key = advisory_key(f'token:{name}')
+        self.logins = 0
+        self.reused = 0
+
+    async def refresh(self, login: Callable[[], Awaitable[tuple[str, datetime.datetime]]], current: str,
+                      margin: float) -> tuple[str, datetime.datetime]:
+        # current - токен этого процесса, который истекает или отклонен сервером.
+        # Если в базе уже другой свежий токен, его обновил соседний процесс
+        if not connected():
+            # База еще поднимается при старте: логинимся сами, без записи в tokens
+            token, valid_thru = await login()
+            self.logins += 1
+            return token, valid_thru
+        async with db.transaction():
+            await db.scalar(db.select([db.func.pg_advisory_xact_lock(self.key)]))
+            row = await Tokens.get(self.name)
+            if row is not None and row.token != current:
+                left = (row.valid_thru - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+                if left > margin:
+                    self.reused += 1
+                    return row.token, row.valid_thru
+            token, valid_thru = await login()
+            await insert(Tokens.__table__).values(
+                name=self.name, token=token, valid_thru=valid_thru, updated_at=now()
+            ).on_conflict_do_update(
+                index_elements=['name'],
+                set_={'token': token, 'valid_thru': valid_thru, 'updated_at': now()},
+            ).gino.status()
+            self.logins += 1
+            return token, valid_thru
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'logins': self.logins,
+            'reused': self.reused,
+        }
+
+
+class Cluster:
+    """
+    Несколько процессов сервиса над одной базой.
+    Каждый процесс держит на отдельном соединении advisory-блокировку своего instance_id, по ним видно живые процессы.
+    Процесс, взявший блокировку лидера, запускает периодические задачи, при потере соединения останавливает их
+    """
+
+    def __init__(self, name: str = 'ggsel', interval: float = 5):
+        self.leader_key = advisory_key(f'leader:{name}')
+        self.instance_id = random.getrandbits(62)
+        self.interval = interval
+        self.on_elected: Callable[[], Awaitable[None]] = None
+        self.on_demoted: Callable[[], Awaitable[None]] = None
+        self.conn = None
+        self.leader = False
+        self.task: asyncio.Task = None
+        self.elections = 0
+
+    async def instances(self) -> set[int]:
+        """instance_id процессов, которые сейчас держат соединение с базой"""
+        rows = await db.all(db.text(
+            "SELECT (classid::bigint << 32) | objid::bigint FROM pg_locks "
+            "WHERE locktype = 'advisory' AND objsubid = 1 AND granted "
+            "AND database = (SELECT oid FROM pg_database WHERE datname = current_database())"
+        ))
+        return {row[0] for row in rows}
+
+    def joined(self) -> bool:
+        """Процесс держит блокировку своего instance_id: без нее лидер сочтет его заказы брошенными"""
+        return self.conn is not None
+
+    async def hold(self):
+        if self.conn is None:
+            # Соединение берется из пула asyncpg напрямую: acquire gino оставляет его в контексте,
+            # и задачи, запущенные из on_elected, начали бы делить одно соединение
+            conn = await db.bind.raw_pool.acquire()
+            try:
+                await conn.fetchval('SELECT pg_advisory_lock($1)', self.instance_id)
+            except BaseException:
+                await db.bind.raw_pool.release(conn)
+                raise
+            self.conn = conn
+        else:
+            await self.conn.fetchval('SELECT 1')
+        if not self.leader:
+            self.leader = await self.conn.fetchval('SELECT pg_try_advisory_lock($1)', self.leader_key)
+            if self.leader:
+                self.elections += 1
+                logger.info('Instance %s is the leader now', self.instance_id)
+                await self.on_elected()
+
+    async def release(self):
+        if self.leader:
+            self.leader = False
+            try:
+                await self.on_demoted()
+            except Exception:
+                logger.exception('Failed to stop leader jobs')
+        if self.conn is not None:
+            conn, self.conn = self.conn, None
+            try:
+                # Соединение вернется в пул, блокировки снимаем явно
+                await conn.execute('SELECT pg_advisory_unlock_all()')
+                await db.bind.raw_pool.release(conn)
+            except Exception:
+                logger.exception('Failed to release cluster connection')
+
+    async def run(self):
+        while True:
+            try:
+                await self.hold()
+            except Exception:
+                logger.exception('Lost cluster connection of instance %s', self.instance_id)
+                await self.release()
+            await asyncio.sleep(self.interval)
+
+    async def start(self, on_elected: Callable[[], Awaitable[None]], on_demoted: Callable[[], Awaitable[None]]):
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        # Первая попытка сразу, чтобы instance_id был виден до того, как воркеры возьмут заказы.
+        # Ошибка уходит в Startup: шаг cluster повторится, зависящие от него jobs и outbox подождут
+        try:
+            await self.hold()
+        except BaseException:
+            await self.release()
+            raise
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        await self.release()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'leader': int(self.leader),
+            'elections': self.elections,
+        }
@@ -7,9 +7,51 @@ load_dotenv()
 
 
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
+# Свой адрес Bot API (локальный сервер или заглушка для нагрузочных тестов)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", 1))
+TELEGRAM_CHAT_BURST = float(os.getenv("TELEGRAM_CHAT_BURST", 3))
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", 25))
+TELEGRAM_DIGEST_THRESHOLD = int(os.getenv("TELEGRAM_DIGEST_THRESHOLD", 5))
 GGSEL_TOKEN = os.getenv("GGSEL_TOKEN")
 SELLER_ID = int(os.getenv("SELLER_ID"))
+GGSEL_BASE_URL = os.getenv("GGSEL_BASE_URL", "https://seller.ggsel.com")
+GGSEL_TOKEN_REFRESH_MARGIN = float(os.getenv("GGSEL_TOKEN_REFRESH_MARGIN", 300))
 ADMIN_ID = int(os.getenv("ADMIN_ID"))
+# Bearer-токен служебных HTTP-ручек (/routes, /messages, /trace, /sales, /tasks), без него они закрыты
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN")
+
+GGSEL_CONNECTIONS_LIMIT = int(os.getenv("GGSEL_CONNECTIONS_LIMIT", 100))
+GGSEL_CONNECTIONS_PER_HOST = int(os.getenv("GGSEL_CONNECTIONS_PER_HOST", 20))
+GGSEL_TIMEOUT = float(os.getenv("GGSEL_TIMEOUT", 30))
+GGSEL_CONNECT_TIMEOUT = float(os.getenv("GGSEL_CONNECT_TIMEOUT", 10))
+GGSEL_KEEPALIVE_TIMEOUT = float(os.getenv("GGSEL_KEEPALIVE_TIMEOUT", 60))
+GGSEL_DNS_CACHE_TTL = int(os.getenv("GGSEL_DNS_CACHE_TTL", 300))
+GGSEL_MAX_CONCURRENCY = int(os.getenv("GGSEL_MAX_CONCURRENCY", 10))
+GGSEL_RATE = float(os.getenv("GGSEL_RATE", 10))
+GGSEL_RETRY_ATTEMPTS = int(os.getenv("GGSEL_RETRY_ATTEMPTS", 3))
+GGSEL_RETRY_BASE_DELAY = float(os.getenv("GGSEL_RETRY_BASE_DELAY", 0.5))
+GGSEL_RETRY_MAX_DELAY = float(os.getenv("GGSEL_RETRY_MAX_DELAY", 10))
+GGSEL_BREAKER_THRESHOLD = int(os.getenv("GGSEL_BREAKER_THRESHOLD", 5))
+GGSEL_BREAKER_RESET_TIMEOUT = float(os.getenv("GGSEL_BREAKER_RESET_TIMEOUT", 30))
+
+PRODUCT_CACHE_SIZE = int(os.getenv("PRODUCT_CACHE_SIZE", 1024))
+PRODUCT_CACHE_TTL = float(os.getenv("PRODUCT_CACHE_TTL", 300))
+PRODUCT_BATCH_DELAY = float(os.getenv("PRODUCT_BATCH_DELAY", 0.005))
+PRODUCT_BATCH_SIZE = int(os.getenv("PRODUCT_BATCH_SIZE", 100))
+
+CATALOG_SYNC_INTERVAL = float(os.getenv("CATALOG_SYNC_INTERVAL", 600))
+CATALOG_PAGE_SIZE = int(os.getenv("CATALOG_PAGE_SIZE", 50))
+CATALOG_CONCURRENCY = int(os.getenv("CATALOG_CONCURRENCY", 4))
+
+OPTION_SCHEMA_CACHE_SIZE = int(os.getenv("OPTION_SCHEMA_CACHE_SIZE", 1024))
+OPTION_SCHEMA_TTL = float(os.getenv("OPTION_SCHEMA_TTL", 3600))
+
+GAME_ROUTES_RELOAD_INTERVAL = float(os.getenv("GAME_ROUTES_RELOAD_INTERVAL", 300))
+
+# Детали заказов: завершенные хранятся бессрочно, остальные ORDER_INFO_TTL секунд
+ORDER_INFO_CACHE_SIZE = int(os.getenv("ORDER_INFO_CACHE_SIZE", 4096))
+ORDER_INFO_TTL = float(os.getenv("ORDER_INFO_TTL", 60))
 
 DB_HOST = os.getenv('DB_HOST')
 DB_PORT = int(os.getenv('DB_PORT'))
@@ -17,7 +59,51 @@ DB_USER = os.getenv('DB_USER')
 DB_PASSWORD = os.getenv('DB_PASSWORD')
 DB_NAME = os.getenv('DB_NAME')
 
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 4))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 5))
+DEDUP_SIZE = int(os.getenv("DEDUP_SIZE", 10000))
+DEDUP_TTL = float(os.getenv("DEDUP_TTL", 86400))
+JOB_RECOVERY_INTERVAL = float(os.getenv("JOB_RECOVERY_INTERVAL", 60))
+# Сколько необработанных заказов допускается, дальше /notification отвечает 503 с Retry-After
+JOB_MAX_BACKLOG = int(os.getenv("JOB_MAX_BACKLOG", 1000))
+BACKLOG_RETRY_AFTER = float(os.getenv("BACKLOG_RETRY_AFTER", 30))
+VERIFICATION_CONCURRENCY = int(os.getenv("VERIFICATION_CONCURRENCY", 4))
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", 30))
+# Таймаут одной попытки шага запуска (база, токен GGSel, ...), неудачные шаги повторяются в фоне
+STARTUP_STEP_TIMEOUT = float(os.getenv("STARTUP_STEP_TIMEOUT", 10))
+STARTUP_RETRY_MAX_DELAY = float(os.getenv("STARTUP_RETRY_MAX_DELAY", 30))
+INVOICE_FLUSH_ROWS = int(os.getenv("INVOICE_FLUSH_ROWS", 500))
+INVOICE_FLUSH_INTERVAL = float(os.getenv("INVOICE_FLUSH_INTERVAL", 0.05))
+# Сообщения покупателям: параллельные отправки, лимит на весь сервис в секунду, попытки до FAILED
+BUYER_MESSAGE_WORKERS = int(os.getenv("BUYER_MESSAGE_WORKERS", 4))
+BUYER_MESSAGE_RATE = float(os.getenv("BUYER_MESSAGE_RATE", 2))
+BUYER_MESSAGE_ATTEMPTS = int(os.getenv("BUYER_MESSAGE_ATTEMPTS", 5))
+BUYER_MESSAGE_RETRY_DELAY = float(os.getenv("BUYER_MESSAGE_RETRY_DELAY", 5))
+BUYER_MESSAGE_POLL_INTERVAL = float(os.getenv("BUYER_MESSAGE_POLL_INTERVAL", 1))
+# Пауза перед сообщением покупателю после запроса кода
+BUYER_MESSAGE_DELAY = float(os.getenv("BUYER_MESSAGE_DELAY", 15))
+# Отложенные действия: сколько выполняется одновременно и как часто подгружаются таймеры из базы
+SCHEDULER_CONCURRENCY = int(os.getenv("SCHEDULER_CONCURRENCY", 8))
+SCHEDULER_RELOAD_INTERVAL = float(os.getenv("SCHEDULER_RELOAD_INTERVAL", 10))
+# Трассировка заказов: размер кольцевого буфера спанов, период записи в базу, срок хранения
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", 10000))
+TRACE_FLUSH_INTERVAL = float(os.getenv("TRACE_FLUSH_INTERVAL", 1))
+TRACE_RETENTION_DAYS = float(os.getenv("TRACE_RETENTION_DAYS", 14))
+
+# Число процессов uvicorn. Лимиты запросов к GGSel и Telegram делятся между процессами
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", 1))
+CLUSTER_INTERVAL = float(os.getenv("CLUSTER_INTERVAL", 5))
+
+SALES_POLL_MIN_INTERVAL = float(os.getenv("SALES_POLL_MIN_INTERVAL", 10))
+SALES_POLL_MAX_INTERVAL = float(os.getenv("SALES_POLL_MAX_INTERVAL", 120))
+SALES_POLL_TOP = int(os.getenv("SALES_POLL_TOP", 20))
+SALES_RECHECK_INTERVAL = float(os.getenv("SALES_RECHECK_INTERVAL", 600))
+SALES_RECHECK_DAYS = int(os.getenv("SALES_RECHECK_DAYS", 14))
+SALES_RECHECK_BATCH = int(os.getenv("SALES_RECHECK_BATCH", 100))
+
 CAPTCHA_TOKEN = os.getenv("CAPTCHA_TOKEN")
+CAPTCHA_API_URL = os.getenv("CAPTCHA_API_URL", "https://api.nextcaptcha.com")
+SUPERCELL_ID_URL = os.getenv("SUPERCELL_ID_URL", "https://id.supercell.com")
 
 
 PROXY_IP = os.getenv("PROXY_IP")
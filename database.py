@@ -1,11 +1,18 @@
+import asyncio
 import datetime
+import logging
+from enum import IntEnum
 
-from gino import Gino
-from sqlalchemy import Column, Integer, DateTime, BigInteger, Boolean
+from gino import Gino, GinoEngine
+from sqlalchemy import Column, Integer, DateTime, Date, BigInteger, Boolean, String, Float
+from sqlalchemy.dialects.postgresql import JSONB
 
 from config import DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_NAME
 
 
+logger = logging.getLogger(__name__)
+
+
 def now():
     return datetime.datetime.now(
         tz=datetime.timezone(datetime.timedelta(hours=3))
@@ -15,6 +22,24 @@ def now():
 db = Gino()
 
 
+class InvoiceStatus(IntEnum):
+    """Статусы обработки уведомления"""
+    NEW = 1
+    PROCESSING = 2
+    DONE = 3
+    FAILED = 4
+    # Игра товара не определена, заказ выдается вручную
+    MANUAL = 5
+
+
+class MessageStatus(IntEnum):
+    """Статусы сообщения покупателю в очереди"""
+    PENDING = 1
+    SENDING = 2
+    SENT = 3
+    FAILED = 4
+
+
 class Invoices(db.Model):
     __tablename__ = 'invoices'
 
@@ -24,9 +49,307 @@ class Invoices(db.Model):
     item_id = Column(Integer)
     created_at = Column(DateTime(timezone=True), default=now)
     sent = Column(Boolean, default=False)
+    # Процесс, который взял заказ в работу (Cluster.instance_id)
+    claimed_by = Column(BigInteger)
+
+
+class Products(db.Model):
+    """Локальная копия каталога GGSel"""
+    __tablename__ = 'products'
+
+    id = Column(BigInteger, primary_key=True)
+    name = Column(String)
+    price = Column(Float)
+    currency = Column(String)
+    price_rub = Column(Float)
+    price_usd = Column(Float)
+    price_eur = Column(Float)
+    in_stock = Column(Integer)
+    num_in_stock = Column(Integer)
+    num_options = Column(Integer)
+    row_hash = Column(String(32))
+    updated_at = Column(DateTime(timezone=True), default=now)
+
+
+class GameRoutes(db.Model):
+    """Ручная привязка товара к игре. game = NULL - товар всегда выдается вручную"""
+    __tablename__ = 'game_routes'
+
+    product_id = Column(BigInteger, primary_key=True)
+    game = Column(String)
+    updated_at = Column(DateTime(timezone=True), default=now)
+
+
+class Sales(db.Model):
+    """Заказы, учтенные в sales_daily, по ним повторный учет заказа не меняет суммы"""
+    __tablename__ = 'sales'
+
+    invoice_id = Column(BigInteger, primary_key=True)
+    product_id = Column(BigInteger)
+    day = Column(Date)
+    currency = Column(String)
+    amount = Column(Float)
+    profit = Column(Float)
+    price_rub = Column(Float)
+    price_usd = Column(Float)
+    price_eur = Column(Float)
+    refunded = Column(Boolean, default=False)
+    updated_at = Column(DateTime(timezone=True), default=now)
+
+
+class SalesDaily(db.Model):
+    """Продажи по товарам за день: amount и profit в валюте оплаты, revenue_* по ценам товара"""
+    __tablename__ = 'sales_daily'
+
+    day = Column(Date, primary_key=True)
+    product_id = Column(BigInteger, primary_key=True)
+    currency = Column(String, primary_key=True)
+    orders = Column(Integer, default=0)
+    refunds = Column(Integer, default=0)
+    amount = Column(Float, default=0)
+    refunded_amount = Column(Float, default=0)
+    profit = Column(Float, default=0)
+    revenue_rub = Column(Float, default=0)
+    revenue_usd = Column(Float, default=0)
+    revenue_eur = Column(Float, default=0)
+
+
+class Tokens(db.Model):
+    """Токены внешних API, общие для всех процессов сервиса"""
+    __tablename__ = 'tokens'
+
+    name = Column(String, primary_key=True)
+    token = Column(String)
+    valid_thru = Column(DateTime(timezone=True))
+    updated_at = Column(DateTime(timezone=True), default=now)
+
+
+class BuyerMessages(db.Model):
+    """Сообщения покупателям в чат заказа. Пишутся до отправки, уходят по порядку id внутри инвойса"""
+    __tablename__ = 'buyer_messages'
+
+    id = Column(BigInteger, primary_key=True)
+    invoice_id = Column(BigInteger, index=True)
+    text = Column(String)
+    status = Column(Integer, index=True)
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime(timezone=True), default=now)
+    # Процесс, который отправляет сообщение (Cluster.instance_id)
+    claimed_by = Column(BigInteger)
+    error = Column(String)
+    created_at = Column(DateTime(timezone=True), default=now)
+    sent_at = Column(DateTime(timezone=True))
+
+
+class Timers(db.Model):
+    """Отложенные действия Scheduler: выполнить action с аргументами payload в run_at"""
+    __tablename__ = 'timers'
+
+    id = Column(BigInteger, primary_key=True)
+    action = Column(String)
+    payload = Column(JSONB)
+    run_at = Column(DateTime(timezone=True), index=True)
+    attempts = Column(Integer, default=0)
+    failed = Column(Boolean, default=False)
+    error = Column(String)
+    created_at = Column(DateTime(timezone=True), default=now)
+
+
+class Spans(db.Model):
+    """Этапы обработки заказа по времени, пишутся пачками из SpanStore"""
+    __tablename__ = 'spans'
+
+    id = Column(BigInteger, primary_key=True)
+    invoice_id = Column(BigInteger, index=True)
+    stage = Column(String)
+    started_at = Column(DateTime(timezone=True), index=True)
+    duration_ms = Column(Float)
+    # Тип исключения, если этап завершился ошибкой
+    error = Column(String)
+
+
+class OrderInfo(db.Model):
+    """Ответы GGSel с деталями инвойса как есть, для повторного чтения без запроса к API"""
+    __tablename__ = 'order_info'
+
+    invoice_id = Column(BigInteger, primary_key=True)
+    # InvoiceState, NULL - ответ без content
+    state = Column(Integer)
+    raw = Column(String)
+    fetched_at = Column(DateTime(timezone=True), default=now)
+
+
+INSERT_INVOICES = db.text("""
+    INSERT INTO invoices (invoice_id, item_id, status, created_at, sent)
+    SELECT * FROM unnest(CAST(:invoice_ids AS BIGINT[]), CAST(:item_ids AS INTEGER[]), CAST(:statuses AS INTEGER[]),
+                         CAST(:created_at AS TIMESTAMPTZ[]), CAST(:sent AS BOOLEAN[]))
+    ON CONFLICT (invoice_id) DO NOTHING
+    RETURNING invoice_id
+""")
+
+UPDATE_INVOICES = db.text("""
+    UPDATE invoices SET status = v.status, sent = v.sent
+    FROM unnest(CAST(:invoice_ids AS BIGINT[]), CAST(:statuses AS INTEGER[]), CAST(:sent AS BOOLEAN[]))
+        AS v(invoice_id, status, sent)
+    WHERE invoices.invoice_id = v.invoice_id
+""")
+
+
+class InvoiceWriter:
+    """
+    Отложенная запись invoices: новые заказы и смена статуса копятся в памяти и пишутся
+    одним INSERT и одним UPDATE на пачку, когда набралось max_rows строк или прошло interval секунд.
+    flush() пишет буфер сразу, stop() дописывает остаток при остановке
+    """
+
+    def __init__(self, max_rows: int = 500, interval: float = 0.05):
+        self.max_rows = max_rows
+        self.interval = interval
+        self.inserts: dict[int, dict] = {}
+        self.updates: dict[int, dict] = {}
+        # Результат вставки для тех, кому нужно знать, был ли заказ новым
+        self.created: dict[int, asyncio.Future] = {}
+        self.full = asyncio.Event()
+        self.lock = asyncio.Lock()
+        self.task: asyncio.Task = None
+        self.closing = False
+        self.flushes = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.updated = 0
+
+    def __len__(self):
+        return len(self.inserts) + len(self.updates)
+
+    def add(self, invoice_id: int, item_id: int, status: int = InvoiceStatus.NEW) -> asyncio.Future:
+        """Буферизует новый заказ. Future получит True, если заказа еще не было в базе"""
+        if invoice_id not in self.inserts:
+            self.inserts[invoice_id] = {'item_id': item_id, 'status': status, 'created_at': now(), 'sent': False}
+        created = self.created.get(invoice_id)
+        if created is None:
+            created = self.created[invoice_id] = asyncio.get_running_loop().create_future()
+        self.check_size()
+        return created
+
+    def update(self, invoice_id: int, status: int, sent: bool):
+        row = self.inserts.get(invoice_id)
+        if row is not None:
+            # Заказ еще не записан, статус уйдет вместе со вставкой
+            row.update(status=status, sent=sent)
+        else:
+            self.updates[invoice_id] = {'status': status, 'sent': sent}
+        self.check_size()
+
+    def check_size(self):
+        if len(self) >= self.max_rows:
+            self.full.set()
+
+    async def flush(self) -> int:
+        async with self.lock:
+            inserts, self.inserts = self.inserts, {}
+            updates, self.updates = self.updates, {}
+            if not inserts and not updates:
+                return 0
+            try:
+                async with db.transaction():
+                    created = set()
+                    if inserts:
+                        rows = await db.all(INSERT_INVOICES.bindparams(
+                            invoice_ids=list(inserts),
+                            item_ids=[row['item_id'] for row in inserts.values()],
+                            statuses=[int(row['status']) for row in inserts.values()],
+                            created_at=[row['created_at'] for row in inserts.values()],
+                            sent=[row['sent'] for row in inserts.values()],
+                        ))
+                        created = {row[0] for row in rows}
+                    if updates:
+                        await db.status(UPDATE_INVOICES.bindparams(
+                            invoice_ids=list(updates),
+                            statuses=[int(row['status']) for row in updates.values()],
+                            sent=[row['sent'] for row in updates.values()],
+                        ))
+            except BaseException:
+                # Возвращаем пачку в буфер (и при отмене задачи посреди записи), более свежие изменения тех же заказов не затираем
+                for invoice_id, row in inserts.items():
+                    self.inserts.setdefault(invoice_id, row)
+                for invoice_id, row in updates.items():
+                    self.updates.setdefault(invoice_id, row)
+                raise
+            self.flushes += 1
+            self.inserted += len(created)
+            self.duplicates += len(inserts) - len(created)
+            self.updated += len(updates)
+            for invoice_id in inserts:
+                future = self.created.pop(invoice_id, None)
+                if future is not None and not future.done():
+                    future.set_result(invoice_id in created)
+            return len(inserts) + len(updates)
+
+    async def run(self):
+        while not self.closing:
+            try:
+                await asyncio.wait_for(self.full.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.full.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception('Failed to flush %s invoice rows', len(self))
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.closing = False
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        # Цикл не отменяется, а дописывает текущую пачку и выходит, остаток пишется здесь
+        if self.task is not None:
+            self.closing = True
+            self.full.set()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        await self.flush()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'buffered': len(self),
+            'flushes': self.flushes,
+            'inserted': self.inserted,
+            'duplicates': self.duplicates,
+            'updated': self.updated,
+        }
 
 
 async def connect():
     await db.set_bind(f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}")
+
+
+def connected() -> bool:
+    # До set_bind в db.bind заглушка, которая бросает исключение на любое обращение, в том числе из isinstance
+    return issubclass(type(db.bind), GinoEngine)
+
+
+async def disconnect():
+    if connected():
+        await db.pop_bind().close()
+
+
+async def create_schema():
+    """Создает таблицы. Запускается отдельно перед деплоем, а не при старте каждого процесса"""
     await db.gino.create_all()
+    # create_all не добавляет колонки в существующие таблицы
+    await db.status(db.text('ALTER TABLE invoices ADD COLUMN IF NOT EXISTS claimed_by BIGINT'))
+
+
+async def migrate():
+    await connect()
+    try:
+        await create_schema()
+    finally:
+        await disconnect()
+
+
+if __name__ == '__main__':
+    asyncio.run(migrate())
 
@@ -2,13 +2,28 @@ import asyncio
 import time
 import hashlib
 import datetime
+import json
+from collections import deque
+from typing import AsyncIterator, TypeVar, TYPE_CHECKING
 
-from aiohttp import ClientSession
+from aiohttp import ClientError, ClientSession, ClientTimeout, TCPConnector
+from pydantic import BaseModel
 
-from models import LastSalesResponse, ProductsAllResponse, OrderInfoResponse, ProductInfoResponse
+from auth import TokenManager
+from batching import Batcher
+from cache import TTLCache
+from metrics import observe_upstream
+from resilience import CircuitBreaker, Limiter, RejectedError, RetryPolicy, UpstreamError, parse_retry_after
+from models import (LastSalesResponse, ProductsAllResponse, OrderInfoResponse, ProductInfoResponse, ProductRowBrief,
+                    ProductsBriefResponse)
+
+if TYPE_CHECKING:
+    from cluster import SharedToken
 
 BASE_URL = "https://seller.ggsel.com"
 
+Response = TypeVar('Response', bound=BaseModel)
+
 HEADERS = {
     "Accept": "application/json, text/plain, */*",
     "Accept-Language": "ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7",
@@ -22,12 +37,68 @@ HEADERS = {
 
 
 class GGSel:
-    def __init__(self, token: str, seller_id: int):
+    def __init__(self, token: str, seller_id: int, base_url: str = BASE_URL, limit: int = 100,
+                 limit_per_host: int = 20, timeout: float = 30, connect_timeout: float = 10,
+                 keepalive_timeout: float = 60, dns_ttl: int = 300, product_cache_size: int = 1024,
+                 product_cache_ttl: float = 300, product_batch_delay: float = 0.005, product_batch_size: int = 100,
+                 token_refresh_margin: float = 300, max_concurrency: int = 10, rate: float = 10,
+                 retry_attempts: int = 3, retry_base_delay: float = 0.5, retry_max_delay: float = 10,
+                 breaker_threshold: int = 5, breaker_reset_timeout: float = 30, token_store: 'SharedToken' = None):
         self.base_token = token
         self.seller_id = seller_id
-        self.token = None
+        self.base_url = base_url
+        self.auth = TokenManager(self.login, margin=token_refresh_margin, store=token_store)
+
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = ClientTimeout(total=timeout, connect=connect_timeout)
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_ttl = dns_ttl
+        self.session: ClientSession = None
+
+        self.limiter = Limiter(concurrency=max_concurrency, rate=rate)
+        self.retry_policy = RetryPolicy(attempts=retry_attempts, base_delay=retry_base_delay,
+                                        max_delay=retry_max_delay)
+        self.breaker = CircuitBreaker(failure_threshold=breaker_threshold, reset_timeout=breaker_reset_timeout)
+        self.requests = 0
+        self.retries = 0
+        self.errors = 0
+        self.throttled = 0
+
+        self.product_cache = TTLCache(maxsize=product_cache_size, ttl=product_cache_ttl)
+        self.product_rows = TTLCache(maxsize=product_cache_size, ttl=product_cache_ttl)
+        self.product_batcher = Batcher(self.load_product_rows, delay=product_batch_delay, max_batch=product_batch_size)
+
+    async def open(self):
+        # One pooled session for the whole life of the client: keep-alive connections and cached DNS
+        # instead of a new TCP/TLS handshake on every call
+        if self.session is not None and not self.session.closed:
+            return
+        connector = TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host,
+                                 ttl_dns_cache=self.dns_ttl, keepalive_timeout=self.keepalive_timeout)
+        self.session = ClientSession(connector=connector, timeout=self.timeout, headers=HEADERS)
+
+    async def close(self):
+        await self.auth.stop()
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def get_session(self) -> ClientSession:
+        if self.session is None or self.session.closed:
+            await self.open()
+        return self.session
+
+    @property
+    def token(self) -> str:
+        return self.auth.token
 
     async def connect(self):
+        await self.auth.refresh()
+        self.auth.start()
+
+    @observe_upstream('login')
+    async def login(self) -> tuple[str, datetime.datetime]:
         ts = str(int(time.time()))
         sign = hashlib.sha256(f'{self.base_token}{ts}'.encode('utf-8')).hexdigest()
         payload = {
@@ -35,29 +106,84 @@ class GGSel:
             "timestamp": ts,
             "sign": sign
         }
-        async with ClientSession() as session:
-            response = await session.post(BASE_URL + '/api_sellers/api/apilogin', json=payload, headers=HEADERS)
+        session = await self.get_session()
+        async with session.post(self.base_url + '/api_sellers/api/apilogin', json=payload) as response:
             data = await response.json()
-        self.token = data['token']
         valid_through = datetime.datetime.strptime(data['valid_thru'][:-2], '%Y-%m-%dT%H:%M:%S.%f').replace(
             tzinfo=datetime.timezone.utc)
-        now = datetime.datetime.now(datetime.timezone.utc)
-        timeout = (valid_through - now).total_seconds()
-        asyncio.create_task(self.update_token(timeout=timeout))
-
-    async def update_token(self, timeout: float):
-        await asyncio.sleep(timeout)
-        await self.connect()
-
-    async def request(self, method: str, url: str, params: dict = None, data: dict = None) -> str:
-        if not 'token' in params:
-            params['token'] = self.token
-        async with ClientSession() as session:
-            response = await session.request(method, BASE_URL + url, params=params, json=data, headers=HEADERS)
-            data = await response.text()
-        return data
+        return data['token'], valid_through
+
+    async def request(self, method: str, url: str, params: dict = None, data: dict = None,
+                      retry: bool = False) -> str:
+        # retry only for idempotent calls: jittered exponential backoff, Retry-After wins if present.
+        # Open circuit fails fast and is never retried
+        attempts = self.retry_policy.attempts if retry else 1
+        for attempt in range(attempts):
+            try:
+                return await self.send(method, url, params, data)
+            except UpstreamError as e:
+                delay = self.retry_policy.delay(attempt, e.retry_after)
+                if attempt + 1 >= attempts or delay > self.retry_policy.max_delay:
+                    raise
+            self.retries += 1
+            await asyncio.sleep(delay)
+
+    async def send(self, method: str, url: str, params: dict = None, data: dict = None) -> str:
+        self.breaker.check()
+        params = dict(params or {})
+        own_token = 'token' not in params
+        session = await self.get_session()
+        try:
+            async with self.limiter:
+                self.requests += 1
+                for attempt in range(2):
+                    if own_token:
+                        params['token'] = await self.auth.get()
+                    async with session.request(method, self.base_url + url, params=params, json=data) as response:
+                        text = await response.text()
+                    # Expired token: one coalesced re-login and a retry
+                    if response.status == 401 and own_token and attempt == 0:
+                        await self.auth.refresh(stale=params['token'])
+                        continue
+                    break
+        except (ClientError, asyncio.TimeoutError) as e:
+            self.errors += 1
+            self.breaker.record_failure()
+            raise UpstreamError(message=repr(e)) from e
+        except BaseException:
+            self.breaker.cancel_probe()
+            raise
+        if response.status == 429 or response.status >= 500:
+            self.errors += 1
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            if response.status == 429:
+                self.throttled += 1
+                if retry_after:
+                    self.limiter.bucket.pause(retry_after)
+                # GGSel жив, но ограничивает частоту: это не ошибка, но пробный запрос не состоялся
+                self.breaker.cancel_probe()
+            else:
+                self.breaker.record_failure()
+            raise UpstreamError(response.status, text[:200], retry_after)
+        self.breaker.record_success()
+        return text
 
-    async def get_all_products(self, ids: list[int] = None, page: int = 1, count: int = 10) -> ProductsAllResponse:
+    def stats(self) -> dict[str, int | str]:
+        return {
+            'requests': self.requests,
+            'retries': self.retries,
+            'errors': self.errors,
+            'throttled': self.throttled,
+            'limiter_waits': self.limiter.waits,
+            'breaker_state': self.breaker.state,
+            'breaker_opened': self.breaker.opened,
+            'breaker_rejected': self.breaker.rejected,
+        }
+
+    @observe_upstream('get_all_products')
+    async def get_all_products(self, ids: list[int] = None, page: int = 1, count: int = 10,
+                               projection: type[Response] = ProductsAllResponse) -> Response:
+        # projection: response model to parse into, e.g. ProductsBriefResponse to skip the unused fields
         # API Docs: https://seller.ggsel.net/docs/return-all-products
         url = '/api_sellers/api/products/list'
         if ids:
@@ -69,9 +195,36 @@ class GGSel:
             'page': page,
             'count': count,
         }
-        data = await self.request('GET', url, params)
-        return ProductsAllResponse.model_validate_json(data)
+        data = await self.request('GET', url, params, retry=True)
+        return projection.model_validate_json(data)
+
+    async def iter_all_products(self, ids: list[int] = None, count: int = 50, concurrency: int = 4,
+                                projection: type[Response] = ProductsAllResponse) -> AsyncIterator[BaseModel]:
+        # Walks every page of products/list. Up to `concurrency` next pages are prefetched,
+        # rows are yielded in page order and at most that many pages are held in memory
+        first = await self.get_all_products(ids=ids, page=1, count=count, projection=projection)
+        pages = iter(range(2, first.total_pages + 1))
+        window: deque[asyncio.Task] = deque()
+        try:
+            for page in pages:
+                window.append(asyncio.create_task(self.get_all_products(ids=ids, page=page, count=count, projection=projection)))
+                if len(window) >= concurrency:
+                    break
+            for row in first.rows:
+                yield row
+            del first
+            while window:
+                response = await window.popleft()
+                page = next(pages, None)
+                if page is not None:
+                    window.append(asyncio.create_task(self.get_all_products(ids=ids, page=page, count=count, projection=projection)))
+                for row in response.rows:
+                    yield row
+        finally:
+            for task in window:
+                task.cancel()
 
+    @observe_upstream('get_last_sales')
     async def get_last_sales(self, group: bool = None, top: int = 10) -> LastSalesResponse:
         # API Docs: https://seller.ggsel.net/docs/return-last-sales
         url = '/api_sellers/api/seller-last-sales'
@@ -80,23 +233,51 @@ class GGSel:
         }
         if group is not None:
             params['group'] = group
-        data = await self.request(method='GET', url=url, params=params)
+        data = await self.request(method='GET', url=url, params=params, retry=True)
         return LastSalesResponse.model_validate_json(data)
 
-    async def get_order_info(self, invoice_id: int) -> OrderInfoResponse:
+    async def get_order_info(self, invoice_id: int, projection: type[Response] = OrderInfoResponse) -> Response:
+        return projection.model_validate_json(await self.fetch_order_info(invoice_id))
+
+    @observe_upstream('get_order_info')
+    async def fetch_order_info(self, invoice_id: int) -> str:
+        # Raw JSON of the answer, OrderCache keeps it in Postgres as is
         # API Docs: https://seller.ggsel.net/docs/get-order-info
         url = f'/api_sellers/api/purchase/info/{invoice_id}'
         params = {}
-        data = await self.request(method='GET', url=url, params=params)
-        return OrderInfoResponse.model_validate_json(data)
+        return await self.request(method='GET', url=url, params=params, retry=True)
 
-    async def get_product_info(self, product_id: int) -> ProductInfoResponse:
+    async def get_product_info(self, product_id: int, projection: type[Response] = ProductInfoResponse) -> Response:
+        # Concurrent misses for one product share a single upstream request
+        return await self.product_cache.get_or_load(
+            (product_id, projection), lambda: self.fetch_product_info(product_id, projection))
+
+    def invalidate_product_info(self, product_id: int = None):
+        if product_id is None:
+            self.product_cache.clear()
+            self.product_rows.clear()
+        else:
+            self.product_cache.invalidate_matching(lambda key: key[0] == product_id)
+            self.product_rows.invalidate(product_id)
+
+    async def get_product_row(self, product_id: int) -> ProductRowBrief | None:
+        # Lookups issued within a few ms are sent as one products/list request.
+        # Returns None if the list has no such product, use get_product_info for it and for ProductFull-only fields
+        return await self.product_rows.get_or_load(product_id, lambda: self.product_batcher.load(product_id))
+
+    async def load_product_rows(self, ids: list[int]) -> dict[int, ProductRowBrief]:
+        response = await self.get_all_products(ids=ids, count=len(ids), projection=ProductsBriefResponse)
+        return {row.id_goods: row for row in response.rows}
+
+    @observe_upstream('fetch_product_info')
+    async def fetch_product_info(self, product_id: int, projection: type[Response] = ProductInfoResponse) -> Response:
         # API Docs: https://seller.ggsel.net/docs/return-product-info
         url = f'/api_sellers/api/products/{product_id}/data'
         params = {}
-        data = await self.request(method='GET', url=url, params=params)
-        return ProductInfoResponse.model_validate_json(data)
+        data = await self.request(method='GET', url=url, params=params, retry=True)
+        return projection.model_validate_json(data)
 
+    @observe_upstream('get_all_categories')
     async def get_all_categories(self, page: int = 1, count: int = 1, category_id: int = None):
         # API Docs: https://seller.ggsel.net/docs/return-all-categories
 
@@ -112,6 +293,7 @@ class GGSel:
         data = await self.request(method='GET', url=url, params=params)
         return data
 
+    @observe_upstream('send_message')
     async def send_message(self, id_i: int, message: str):
         # API Docs: https://seller.ggsel.net/docs/create-message-without-file
 
@@ -122,5 +304,12 @@ class GGSel:
         data = {
             'message': message
         }
-        await self.request(method='POST', url=url, params=params, data=data)
+        text = await self.request(method='POST', url=url, params=params, data=data)
+        # Without this check a refused message was lost silently
+        try:
+            retval = json.loads(text).get('retval')
+        except (ValueError, AttributeError):
+            raise RejectedError(text[:200])
+        if retval:
+            raise RejectedError(text[:200])
 
@@ -0,0 +1,183 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+from sqlalchemy import and_, func, or_
+
+from cache import TTLCache
+from cluster import Cluster
+from database import db, connected, Invoices, InvoiceStatus, InvoiceWriter
+from supervisor import Overloaded, Supervisor
+
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueue:
+    """
+    Очередь обработки заказов поверх таблицы invoices.
+    Уведомления и итоговые статусы пишутся пачками через InvoiceWriter, диспетчер забирает заказы через FOR UPDATE SKIP LOCKED, когда у supervisor
+    есть свободный слот вида kind, handler может вернуть итоговый статус заказа (по умолчанию DONE).
+    Если необработанных заказов больше max_backlog, новые уведомления отклоняются.
+    Заказы процессов, которые остановились посреди обработки, ведущий процесс возвращает в очередь
+    """
+
+    def __init__(self, handler: Callable[[int, int], Awaitable[InvoiceStatus | None]], cluster: Cluster,
+                 supervisor: Supervisor, writer: InvoiceWriter, kind: str = 'order', poll_interval: float = 5,
+                 max_backlog: int = None, seen_size: int = 10000, seen_ttl: float = 86400,
+                 recovery_interval: float = 60, backlog_timeout: float = 1):
+        self.handler = handler
+        self.cluster = cluster
+        self.supervisor = supervisor
+        self.writer = writer
+        self.kind = kind
+        self.poll_interval = poll_interval
+        self.max_backlog = max_backlog
+        self.recovery_interval = recovery_interval
+        self.backlog_timeout = backlog_timeout
+        self.wakeup = asyncio.Event()
+        self.task: asyncio.Task = None
+        self.recovery: asyncio.Task = None
+
+        # Недавно принятые invoice_id: повторы GGSel отсекаются без запроса в базу,
+        # источник истины - уникальный invoices.invoice_id
+        self.seen = TTLCache(maxsize=seen_size, ttl=seen_ttl)
+        # Число заказов в статусе NEW, общее для всех процессов, пересчитывается не чаще раза в секунду
+        self.pending = TTLCache(maxsize=1, ttl=1)
+        self.enqueued = 0
+        self.duplicates_memory = 0
+        self.rejected = 0
+        self.recovered = 0
+
+    async def backlog(self) -> int:
+        return await self.pending.get_or_load('new', lambda: db.select([func.count()]).where(
+            Invoices.status == InvoiceStatus.NEW
+        ).gino.scalar())
+
+    async def overloaded(self) -> bool:
+        # Неписанные заказы в буфере writer: пока база недоступна, буфер только растет
+        if len(self.writer.inserts) >= self.max_backlog:
+            return True
+        if not connected():
+            return False
+        try:
+            return await asyncio.wait_for(self.backlog(), self.backlog_timeout) >= self.max_backlog
+        except Exception:
+            # База отвалилась после запуска: уведомление копится в буфере, его размер ограничен выше
+            logger.warning('Failed to count invoice backlog', exc_info=True)
+            return False
+
+    async def enqueue(self, invoice_id: int, item_id: int, durable: bool = False) -> bool:
+        """
+        Ставит заказ в очередь через отложенную запись. False, если invoice_id недавно уже приходил.
+        С durable ждет записи в базу и возвращает False, если такой заказ там уже был
+        """
+        if self.seen.get(invoice_id):
+            self.duplicates_memory += 1
+            return False
+        if self.max_backlog is not None and await self.overloaded():
+            # Пропущенный заказ потом подберет SalesPoller или повтор вебхука
+            self.rejected += 1
+            raise Overloaded(self.kind, self.supervisor.retry_after)
+        created = self.writer.add(invoice_id, item_id)
+        created.add_done_callback(self.inserted)
+        self.seen.set(invoice_id, True)
+        self.enqueued += 1
+        if not durable:
+            return True
+        await self.writer.flush()
+        return await created
+
+    def inserted(self, created: asyncio.Future):
+        if created.result():
+            self.wakeup.set()
+
+    async def claim(self) -> Invoices | None:
+        async with db.transaction():
+            invoice = await Invoices.query.where(
+                Invoices.status == InvoiceStatus.NEW
+            ).order_by(Invoices.id).limit(1).with_for_update(skip_locked=True).gino.first()
+            if invoice is not None:
+                await invoice.update(status=InvoiceStatus.PROCESSING, claimed_by=self.cluster.instance_id).apply()
+        return invoice
+
+    async def process(self, invoice: Invoices):
+        try:
+            status = await self.handler(invoice.invoice_id, invoice.item_id) or InvoiceStatus.DONE
+        except Exception:
+            logger.exception('Failed to process invoice %s', invoice.invoice_id)
+            status = InvoiceStatus.FAILED
+        sent = status == InvoiceStatus.DONE
+        self.writer.update(invoice.invoice_id, status, sent)
+
+    async def run(self):
+        while True:
+            # Заказ забирается из базы только под свободный слот, остальные ждут в таблице
+            await self.supervisor.wait_free(self.kind)
+            self.wakeup.clear()
+            if not self.cluster.joined():
+                # Соединение кластера потеряно: взятый сейчас заказ лидер вернул бы в очередь второму процессу
+                await asyncio.sleep(self.poll_interval)
+                continue
+            try:
+                invoice = await self.claim()
+            except Exception:
+                logger.exception('Failed to claim invoice')
+                invoice = None
+            if invoice is None:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self.supervisor.spawn(self.kind, self.process(invoice))
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'enqueued': self.enqueued,
+            'duplicates_memory': self.duplicates_memory,
+            'rejected': self.rejected,
+            'recovered': self.recovered,
+        }
+
+    async def recover(self) -> int:
+        # Заказы в работе у процессов, которых больше нет (их instance_id не держит блокировку), начинаем заново
+        instances = await self.cluster.instances()
+        _, rows = await Invoices.update.values(status=InvoiceStatus.NEW, claimed_by=None).where(and_(
+            Invoices.status == InvoiceStatus.PROCESSING,
+            or_(Invoices.claimed_by.is_(None), Invoices.claimed_by.notin_(instances)),
+        )).returning(Invoices.id).gino.status()
+        if rows:
+            self.recovered += len(rows)
+            logger.warning('Returned %s orders of stopped instances to the queue', len(rows))
+            self.wakeup.set()
+        return len(rows)
+
+    async def run_recovery(self):
+        while True:
+            try:
+                await self.recover()
+            except Exception:
+                logger.exception('Failed to recover orders')
+            await asyncio.sleep(self.recovery_interval)
+
+    def start_recovery(self):
+        if self.recovery is None or self.recovery.done():
+            self.recovery = asyncio.create_task(self.run_recovery())
+
+    async def stop_recovery(self):
+        if self.recovery is not None:
+            self.recovery.cancel()
+            await asyncio.gather(self.recovery, return_exceptions=True)
+            self.recovery = None
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        # Останавливает только прием новых заказов, текущие дорабатывают в supervisor.drain
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
@@ -1,8 +1,98 @@
 from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from analytics import SalesRollup
+from catalog import Catalog
+from cluster import Cluster, SharedToken
+from database import InvoiceWriter
 from ggsel import GGSel
+from notifier import Notifier
+from options import OptionValidator
+from orders import OrderCache
+from outbox import Outbox
+from routing import Router
+from scheduler import Scheduler
+from spans import SpanStore
+from supervisor import Supervisor
+from tracing import Tracer
 
-from config import TELEGRAM_TOKEN, GGSEL_TOKEN, SELLER_ID
+from config import (TELEGRAM_TOKEN, TELEGRAM_API_URL, ADMIN_ID, TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST, TELEGRAM_GLOBAL_RATE,
+                    TELEGRAM_DIGEST_THRESHOLD, GGSEL_TOKEN, SELLER_ID, GGSEL_BASE_URL, GGSEL_TOKEN_REFRESH_MARGIN,
+                    GGSEL_CONNECTIONS_LIMIT, GGSEL_CONNECTIONS_PER_HOST, GGSEL_TIMEOUT, GGSEL_CONNECT_TIMEOUT,
+                    GGSEL_KEEPALIVE_TIMEOUT, GGSEL_DNS_CACHE_TTL, GGSEL_MAX_CONCURRENCY, GGSEL_RATE,
+                    GGSEL_RETRY_ATTEMPTS, GGSEL_RETRY_BASE_DELAY, GGSEL_RETRY_MAX_DELAY, GGSEL_BREAKER_THRESHOLD,
+                    GGSEL_BREAKER_RESET_TIMEOUT, PRODUCT_CACHE_SIZE, PRODUCT_CACHE_TTL, PRODUCT_BATCH_DELAY,
+                    PRODUCT_BATCH_SIZE, CATALOG_SYNC_INTERVAL, CATALOG_PAGE_SIZE, CATALOG_CONCURRENCY,
+                    OPTION_SCHEMA_CACHE_SIZE, OPTION_SCHEMA_TTL, WEB_WORKERS, CLUSTER_INTERVAL,
+                    GAME_ROUTES_RELOAD_INTERVAL, JOB_WORKERS, VERIFICATION_CONCURRENCY, BACKLOG_RETRY_AFTER,
+                    INVOICE_FLUSH_ROWS, INVOICE_FLUSH_INTERVAL, ORDER_INFO_CACHE_SIZE, ORDER_INFO_TTL,
+                    BUYER_MESSAGE_WORKERS, BUYER_MESSAGE_RATE, BUYER_MESSAGE_ATTEMPTS, BUYER_MESSAGE_RETRY_DELAY,
+                    BUYER_MESSAGE_POLL_INTERVAL, JOB_RECOVERY_INTERVAL, SCHEDULER_CONCURRENCY, SCHEDULER_RELOAD_INTERVAL,
+                    TRACE_BUFFER_SIZE, TRACE_FLUSH_INTERVAL, TRACE_RETENTION_DAYS, SALES_RECHECK_INTERVAL,
+                    SALES_RECHECK_DAYS, SALES_RECHECK_BATCH)
 
 
-bot = Bot(token=TELEGRAM_TOKEN)
-ggsel = GGSel(GGSEL_TOKEN, SELLER_ID)
+tracer = Tracer(size=TRACE_BUFFER_SIZE)
+spans = SpanStore(tracer, interval=TRACE_FLUSH_INTERVAL, retention_days=TRACE_RETENTION_DAYS)
+cluster = Cluster('ggsel', interval=CLUSTER_INTERVAL)
+invoices = InvoiceWriter(max_rows=INVOICE_FLUSH_ROWS, interval=INVOICE_FLUSH_INTERVAL)
+supervisor = Supervisor(retry_after=BACKLOG_RETRY_AFTER)
+supervisor.register('order', concurrency=JOB_WORKERS)
+supervisor.register('verification', concurrency=VERIFICATION_CONCURRENCY)
+supervisor.register('buyer_message', concurrency=BUYER_MESSAGE_WORKERS)
+supervisor.register('timer', concurrency=SCHEDULER_CONCURRENCY)
+scheduler = Scheduler(supervisor, reload_interval=SCHEDULER_RELOAD_INTERVAL)
+if TELEGRAM_API_URL:
+    bot = Bot(token=TELEGRAM_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)))
+else:
+    bot = Bot(token=TELEGRAM_TOKEN)
+notifier = Notifier(bot,
+                    per_chat_rate=TELEGRAM_CHAT_RATE / WEB_WORKERS,
+                    per_chat_burst=TELEGRAM_CHAT_BURST,
+                    global_rate=TELEGRAM_GLOBAL_RATE / WEB_WORKERS,
+                    digest_chat_id=ADMIN_ID,
+                    digest_threshold=TELEGRAM_DIGEST_THRESHOLD,
+                    tracer=tracer)
+ggsel = GGSel(GGSEL_TOKEN, SELLER_ID,
+              base_url=GGSEL_BASE_URL,
+              limit=GGSEL_CONNECTIONS_LIMIT,
+              limit_per_host=GGSEL_CONNECTIONS_PER_HOST,
+              timeout=GGSEL_TIMEOUT,
+              connect_timeout=GGSEL_CONNECT_TIMEOUT,
+              keepalive_timeout=GGSEL_KEEPALIVE_TIMEOUT,
+              dns_ttl=GGSEL_DNS_CACHE_TTL,
+              product_cache_size=PRODUCT_CACHE_SIZE,
+              product_cache_ttl=PRODUCT_CACHE_TTL,
+              product_batch_delay=PRODUCT_BATCH_DELAY,
+              product_batch_size=PRODUCT_BATCH_SIZE,
+              token_refresh_margin=GGSEL_TOKEN_REFRESH_MARGIN,
+              max_concurrency=GGSEL_MAX_CONCURRENCY,
+              rate=GGSEL_RATE / WEB_WORKERS,
+              retry_attempts=GGSEL_RETRY_ATTEMPTS,
+              retry_base_delay=GGSEL_RETRY_BASE_DELAY,
+              retry_max_delay=GGSEL_RETRY_MAX_DELAY,
+              breaker_threshold=GGSEL_BREAKER_THRESHOLD,
+              breaker_reset_timeout=GGSEL_BREAKER_RESET_TIMEOUT,
+              token_store=SharedToken('ggsel'))
+catalog = Catalog(ggsel,
+                  interval=CATALOG_SYNC_INTERVAL,
+                  page_size=CATALOG_PAGE_SIZE,
+                  concurrency=CATALOG_CONCURRENCY)
+options = OptionValidator(ggsel,
+                         size=OPTION_SCHEMA_CACHE_SIZE,
+                         ttl=OPTION_SCHEMA_TTL)
+orders = OrderCache(ggsel,
+                    size=ORDER_INFO_CACHE_SIZE,
+                    ttl=ORDER_INFO_TTL)
+outbox = Outbox(ggsel, cluster, supervisor,
+                rate=BUYER_MESSAGE_RATE / WEB_WORKERS,
+                max_attempts=BUYER_MESSAGE_ATTEMPTS,
+                retry_delay=BUYER_MESSAGE_RETRY_DELAY,
+                poll_interval=BUYER_MESSAGE_POLL_INTERVAL,
+                recovery_interval=JOB_RECOVERY_INTERVAL,
+                tracer=tracer)
+router = Router(interval=GAME_ROUTES_RELOAD_INTERVAL)
+sales = SalesRollup(orders,
+                    interval=SALES_RECHECK_INTERVAL,
+                    window_days=SALES_RECHECK_DAYS,
+                    batch=SALES_RECHECK_BATCH)
@@ -1,33 +1,123 @@
 import asyncio
+import datetime
+import logging
+import secrets
 from contextlib import asynccontextmanager
-import re
 
-from fastapi import FastAPI
-from fastapi.responses import PlainTextResponse
+from fastapi import Depends, FastAPI, Header, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
 from fastapi.exceptions import RequestValidationError
 from fastapi.requests import Request
 from aiogram import Dispatcher
 from pydantic import BaseModel
-from aiogram.filters.command import CommandStart
+from aiogram.filters.command import Command, CommandObject, CommandStart
 from aiogram.types import Message
 import uvicorn
+from prometheus_client import REGISTRY, CONTENT_TYPE_LATEST, generate_latest
 
-from config import ADMIN_ID
-from database import connect
-from utils import send_verification_code, send_message
-from loader import bot, ggsel
+from analytics import format_daily
+from config import (ADMIN_ID, ADMIN_API_TOKEN, JOB_POLL_INTERVAL, DEDUP_SIZE, DEDUP_TTL, SALES_POLL_MIN_INTERVAL,
+                    SALES_POLL_MAX_INTERVAL, SALES_POLL_TOP, JOB_RECOVERY_INTERVAL, JOB_MAX_BACKLOG, SHUTDOWN_TIMEOUT,
+                    STARTUP_STEP_TIMEOUT, STARTUP_RETRY_MAX_DELAY, WEB_WORKERS)
+from database import MessageStatus, connect, disconnect, now
+from jobs import JobQueue
+from metrics import MetricsMiddleware, StatsCollector
+from models import OrderBriefResponse
+from orders import format_order
+from poller import SalesPoller
+from startup import Startup
+from supervisor import Overloaded
+from utils import send_message, get_product, process_order
+from loader import (bot, ggsel, catalog, cluster, invoices, notifier, options, orders, outbox, router, sales,
+                    scheduler, spans, supervisor, tracer)
+
+
+logger = logging.getLogger(__name__)
+
+
+async def start_leader_jobs():
+    # Периодические задачи нужны в одном экземпляре на все процессы
+    jobs.start_recovery()
+    outbox.start_recovery()
+    catalog.start()
+    poller.start()
+    sales.start()
+    start_polling()
+
+
+async def stop_leader_jobs():
+    await stop_polling()
+    await sales.stop()
+    await poller.stop()
+    await catalog.stop()
+    await outbox.stop_recovery()
+    await jobs.stop_recovery()
+
+
+async def start_ggsel():
+    await ggsel.open()
+    await ggsel.connect()
+
+
+async def start_cluster():
+    await cluster.start(start_leader_jobs, stop_leader_jobs)
+
+
+async def start_invoices():
+    invoices.start()
+
+
+async def start_jobs():
+    jobs.start()
+
+
+async def start_outbox():
+    outbox.start()
+
+
+async def stop_jobs():
+    await jobs.stop()
+    # Начатые заказы дорабатывают, пока процесс держит блокировку кластера, иначе лидер вернет их в очередь
+    await supervisor.drain(SHUTDOWN_TIMEOUT)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    await ggsel.connect()
-    await connect()
-    # asyncio.create_task(long_poll())
+    # Зависимости поднимаются в фоне, запросы принимаются сразу, готовность видна в /readyz
+    startup.start()
+    # Спаны копятся в буфере и пишутся, как только поднимется база
+    spans.start()
     yield
+    # Остановка в обратном порядке: заказы, принятые уведомления и статусы, кластер, таблица игр
+    await startup.stop()
+    await notifier.close()
+    await spans.stop()
+    await bot.session.close()
+    await ggsel.close()
+    await disconnect()
 
 app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
+jobs = JobQueue(process_order, cluster, supervisor, invoices, kind='order', poll_interval=JOB_POLL_INTERVAL,
+                max_backlog=JOB_MAX_BACKLOG, seen_size=DEDUP_SIZE, seen_ttl=DEDUP_TTL,
+                recovery_interval=JOB_RECOVERY_INTERVAL)
+poller = SalesPoller(ggsel, jobs, min_interval=SALES_POLL_MIN_INTERVAL, max_interval=SALES_POLL_MAX_INTERVAL,
+                     top=SALES_POLL_TOP)
+startup = Startup(max_retry_delay=STARTUP_RETRY_MAX_DELAY)
+startup.add('database', connect, timeout=STARTUP_STEP_TIMEOUT)
+# Токен GGSel берется из общей таблицы tokens, чтобы процессы логинились один раз на всех.
+# Если база не поднялась за свой таймаут, процесс логинится сам
+startup.add('ggsel', start_ggsel, after=('database',), timeout=STARTUP_STEP_TIMEOUT)
+startup.add('routes', router.start, router.stop, requires=('database',), timeout=STARTUP_STEP_TIMEOUT)
+startup.add('cluster', start_cluster, cluster.stop, requires=('database',), timeout=STARTUP_STEP_TIMEOUT)
+startup.add('invoices', start_invoices, invoices.stop, requires=('database',), timeout=STARTUP_STEP_TIMEOUT)
+startup.add('jobs', start_jobs, stop_jobs, requires=('ggsel', 'routes', 'cluster', 'invoices'),
+            timeout=STARTUP_STEP_TIMEOUT)
+# Останавливается раньше jobs: после supervisor.drain новые отправки уже не запустить
+startup.add('outbox', start_outbox, outbox.stop, requires=('ggsel', 'cluster'), timeout=STARTUP_STEP_TIMEOUT)
+# Останавливается первым: после supervisor.drain сработавший таймер уже не запустить
+startup.add('scheduler', scheduler.start, scheduler.stop, requires=('database',), timeout=STARTUP_STEP_TIMEOUT)
 dp = Dispatcher()
-email_pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
 
 
 class Notification(BaseModel):
@@ -59,12 +149,16 @@ class CheckParams(BaseModel):
     options: list[Option]
 
 
+class GameRoute(BaseModel):
+    game: str | None
+
 
-game_codes = {
-    'clash of clans': 'magic',
-    'clash royale': 'scroll',
-    'brawl stars': 'laser'
-}
+def require_admin(authorization: str = Header(None)):
+    # Служебные ручки живут в том же приложении, что и публичный вебхук GGSel, поэтому закрыты токеном.
+    # Без ADMIN_API_TOKEN они недоступны совсем
+    expected = f'Bearer {ADMIN_API_TOKEN}'
+    if not ADMIN_API_TOKEN or not secrets.compare_digest((authorization or '').encode(), expected.encode()):
+        raise HTTPException(status_code=401, headers={'WWW-Authenticate': 'Bearer'})
 
 
 @app.exception_handler(RequestValidationError)
@@ -81,41 +175,129 @@ async def index():
     return PlainTextResponse('welcome', status_code=200)
 
 
+def collect_stats() -> dict[str, dict]:
+    return {
+        'jobs': jobs.stats(),
+        'tasks': supervisor.stats(),
+        'invoice_writer': invoices.stats(),
+        'telegram': notifier.stats(),
+        'sales_poller': poller.stats(),
+        'ggsel': ggsel.stats(),
+        'token': ggsel.auth.stats(),
+        'shared_token': ggsel.auth.store.stats(),
+        'cluster': cluster.stats(),
+        'game_routes': router.stats(),
+        'sales': sales.stats(),
+        'product_cache': ggsel.product_cache.stats(),
+        'product_rows': ggsel.product_rows.stats(),
+        'product_batches': ggsel.product_batcher.stats(),
+        'option_schemas': options.stats(),
+        'order_info': orders.stats(),
+        'buyer_messages': outbox.stats(),
+        'scheduler': scheduler.stats(),
+        'tracing': spans.stats(),
+    }
+
+
+REGISTRY.register(StatsCollector(collect_stats))
+
+
+@app.get('/healthz')
+async def healthz():
+    # Процесс жив и цикл событий отвечает, зависимости не проверяются
+    return PlainTextResponse('ok', status_code=200)
+
+
+@app.get('/readyz')
+async def readyz():
+    ready = startup.ready()
+    content = {'ready': ready, 'steps': startup.status()}
+    return JSONResponse(content, status_code=200 if ready else 503)
+
+
+@app.get('/stats')
+async def stats():
+    return collect_stats()
+
+
+@app.get('/metrics')
+async def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 @app.post('/check')
 async def check_order_params(check_params: CheckParams):
-    item = await ggsel.get_product_info(check_params.product.id)
-    reply = f'Хмммм, какой-то кельпастник собирается купить {item.product.name}'
-    for option in check_params.options:
-        if option.type == 'text':
-            if not re.match(email_pattern, option.value):
-                return PlainTextResponse('invalid email', status_code=400)
-    asyncio.create_task(send_message(ADMIN_ID, reply))
+    error = await options.validate(check_params.product.id, check_params.options)
+    if error is not None:
+        return PlainTextResponse(error, status_code=400)
+    name, _ = await get_product(check_params.product.id)
+    reply = f'Хмммм, какой-то кельпастник собирается купить {name}'
+    await send_message(ADMIN_ID, reply)
     return PlainTextResponse('thx', status_code=200)
 
 
 @app.post('/notification')
 async def notification_route(notification: Notification):
-    item = await ggsel.get_product_info(notification.id_d)
-    reply = f'🛒 Афигеть! Какой-то кельпастник оплатил товар! Выдай ему\n\n'
-    reply += (f'Товар: {item.product.name}\n'
-              f'Стоимость: {item.product.price}\n\n')
-    order = await ggsel.get_order_info(notification.id_i)
-    reply += '⚙️ Параметры заказа:\n'
-    email = None
-    for option in order.content.options:
-        reply += f'• {option.name}: {option.user_data}\n'
-        if 'id' in option.name.lower():
-            email = option.user_data
-    asyncio.create_task(send_message(ADMIN_ID, reply))
-    for game, code in game_codes.items():
-        if game in item.product.name.lower():
-            break
-    else:
-        raise Exception()
-    asyncio.create_task(send_verification_code(email, code, notification.id_i))
+    # Заказ сохраняется в очередь, обработка идет в фоновых воркерах.
+    # Повторное уведомление по тому же id_i просто подтверждается
+    tracer.mark('notification', notification.id_i)
+    if not startup.ready('database', 'invoices'):
+        # Пока заказ некуда записать, просим GGSel повторить: из памяти он пропал бы при падении процесса
+        return PlainTextResponse('starting', status_code=503,
+                                 headers={'Retry-After': str(int(supervisor.retry_after))})
+    try:
+        await jobs.enqueue(notification.id_i, notification.id_d)
+    except Overloaded as e:
+        return PlainTextResponse('overloaded', status_code=503, headers={'Retry-After': str(int(e.retry_after))})
     return PlainTextResponse('thx', status_code=200)
 
 
+@app.get('/tasks/errors', dependencies=[Depends(require_admin)])
+async def task_errors():
+    return [{'time': ts, 'kind': kind, 'error': error} for ts, kind, error in supervisor.errors]
+
+
+@app.get('/messages/{invoice_id}', dependencies=[Depends(require_admin)])
+async def buyer_messages(invoice_id: int):
+    # Сообщения покупателю по заказу и их статус доставки
+    messages = await outbox.history(invoice_id)
+    return [{**message.to_dict(), 'status': MessageStatus(message.status).name} for message in messages]
+
+
+@app.get('/trace/stages', dependencies=[Depends(require_admin)])
+async def trace_stages(hours: float = 24):
+    # Задержки этапов по всем заказам за последние hours часов
+    return await spans.stage_latencies(now() - datetime.timedelta(hours=hours))
+
+
+@app.get('/trace/{invoice_id}', dependencies=[Depends(require_admin)])
+async def trace_invoice(invoice_id: int):
+    return await spans.timeline(invoice_id)
+
+
+@app.post('/routes/reload', dependencies=[Depends(require_admin)])
+async def reload_routes():
+    # Перестраивает таблицу в процессе, принявшем запрос, остальные подхватят через GAME_ROUTES_RELOAD_INTERVAL
+    routes = await router.reload()
+    return {'routes': routes}
+
+
+@app.put('/routes/{product_id}', dependencies=[Depends(require_admin)])
+async def set_route(product_id: int, route: GameRoute):
+    try:
+        await router.set_override(product_id, route.game)
+    except ValueError as e:
+        return PlainTextResponse(str(e), status_code=400)
+    return PlainTextResponse('ok', status_code=200)
+
+
+@app.get('/sales/daily', dependencies=[Depends(require_admin)])
+async def sales_daily(day: datetime.date = None):
+    day = day or now().date()
+    rows = await sales.daily(day)
+    return [row.to_dict() for row in rows]
+
+
 @dp.message(CommandStart())
 async def command_start(m: Message):
     await m.answer('Привет! 👋\n'
@@ -123,9 +305,63 @@ async def command_start(m: Message):
                    'Я буду своевременно присылать тебе уведомления о новых покупках, изменениях статуса заказов и другой важной информации с твоего аккаунта.')
 
 
+@dp.message(Command('sales'))
+async def command_sales(m: Message, command: CommandObject):
+    if m.from_user.id != ADMIN_ID:
+        return
+    try:
+        day = datetime.date.fromisoformat(command.args.strip()) if command.args else now().date()
+    except ValueError:
+        await m.answer('Дата в формате ГГГГ-ММ-ДД, например /sales 2026-01-31')
+        return
+    await m.answer(format_daily(day, await sales.daily(day)))
+
+
+@dp.message(Command('order'))
+async def command_order(m: Message, command: CommandObject):
+    if m.from_user.id != ADMIN_ID:
+        return
+    if not command.args or not command.args.strip().isdigit():
+        await m.answer('Номер заказа, например /order 123456')
+        return
+    invoice_id = int(command.args.strip())
+    order = await orders.get(invoice_id, projection=OrderBriefResponse)
+    await m.answer(format_order(invoice_id, order.content))
+
+
 async def long_poll():
-    await dp.start_polling(bot)
+    while True:
+        try:
+            # Сигналы обрабатывает uvicorn, сессию бота закрывает lifespan
+            await dp.start_polling(bot, handle_signals=False, close_bot_session=False)
+            return
+        except Exception:
+            # start_polling падает, если Telegram недоступен при запуске
+            logger.exception('Telegram polling failed, restarting')
+        await asyncio.sleep(STARTUP_RETRY_MAX_DELAY)
+
+
+polling: asyncio.Task = None
+
+
+def start_polling():
+    # Команды бота принимает только лидер: getUpdates из двух процессов конфликтует в Telegram
+    global polling
+    if polling is None or polling.done():
+        polling = asyncio.create_task(long_poll())
+
+
+async def stop_polling():
+    global polling
+    if polling is not None:
+        polling.cancel()
+        await asyncio.gather(polling, return_exceptions=True)
+        polling = None
 
 
 if __name__ == '__main__':
-    uvicorn.run(app, host="127.0.0.1", port=8003)
+    if WEB_WORKERS > 1:
+        # Процессам нужен путь импорта приложения, а не объект
+        uvicorn.run('main:app', host="127.0.0.1", port=8003, workers=WEB_WORKERS)
+    else:
+        uvicorn.run(app, host="127.0.0.1", port=8003)
@@ -0,0 +1,108 @@
+import functools
+import time
+from typing import Callable
+
+from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client.core import GaugeMetricFamily
+
+
+# Дочерние метрики с метками создаются один раз (при импорте или первом обращении к маршруту),
+# на горячем пути только observe/inc без разбора меток
+
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', 'Время обработки HTTP-запроса',
+                            ['method', 'route', 'status'])
+UPSTREAM_LATENCY = Histogram('ggsel_request_duration_seconds', 'Время вызова метода GGSel', ['method'])
+UPSTREAM_ERRORS = Counter('ggsel_request_errors_total', 'Ошибки вызовов GGSel', ['method'])
+TELEGRAM_LATENCY = Histogram('telegram_send_duration_seconds', 'Время отправки сообщения в Telegram')
+TELEGRAM_FAILURES = Counter('telegram_send_failures_total', 'Неотправленные сообщения в Telegram', ['reason'])
+BACKGROUND_TASKS = Gauge('background_tasks_in_flight', 'Фоновые задачи в работе', ['kind'])
+TOKEN_REFRESHES = Counter('ggsel_token_refreshes_total', 'Обновления токена GGSel', ['result'])
+VERIFICATION_CODES = Counter('verification_codes_total', 'Итоги отправки кода подтверждения', ['game', 'outcome'])
+
+TELEGRAM_RETRY_AFTER = TELEGRAM_FAILURES.labels('retry_after')
+TELEGRAM_REJECTED = TELEGRAM_FAILURES.labels('rejected')
+TELEGRAM_ERROR = TELEGRAM_FAILURES.labels('error')
+TOKEN_REFRESH_SUCCESS = TOKEN_REFRESHES.labels('success')
+TOKEN_REFRESH_FAILURE = TOKEN_REFRESHES.labels('failure')
+
+_request_latency: dict[tuple[str, str, int], Histogram] = {}
+_background_tasks: dict[str, Gauge] = {}
+_verification_codes: dict[tuple[str, str], Counter] = {}
+
+
+def background_tasks(kind: str) -> Gauge:
+    gauge = _background_tasks.get(kind)
+    if gauge is None:
+        gauge = _background_tasks[kind] = BACKGROUND_TASKS.labels(kind)
+    return gauge
+
+
+def verification_code(game: str, outcome: str):
+    counter = _verification_codes.get((game, outcome))
+    if counter is None:
+        counter = _verification_codes[(game, outcome)] = VERIFICATION_CODES.labels(game, outcome)
+    counter.inc()
+
+
+def observe_upstream(method: str):
+    """Декоратор метода GGSel: время вызова и ошибки с меткой method"""
+    latency = UPSTREAM_LATENCY.labels(method)
+    errors = UPSTREAM_ERRORS.labels(method)
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                errors.inc()
+                raise
+            finally:
+                latency.observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+class MetricsMiddleware:
+    """ASGI-middleware: гистограмма времени ответа по шаблону маршрута"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get('route')
+            key = (scope['method'], route.path if route is not None else 'unmatched', status)
+            histogram = _request_latency.get(key)
+            if histogram is None:
+                histogram = _request_latency[key] = REQUEST_LATENCY.labels(*key)
+            histogram.observe(time.perf_counter() - start)
+
+
+class StatsCollector:
+    """Отдает счетчики компонентов (кэши, очередь, дедупликация, circuit breaker) в момент сбора метрик"""
+
+    def __init__(self, stats: Callable[[], dict[str, dict]], prefix: str = 'service'):
+        self.stats = stats
+        self.prefix = prefix
+
+    def collect(self):
+        for component, values in self.stats().items():
+            for name, value in values.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                yield GaugeMetricFamily(f'{self.prefix}_{component}_{name}', f'{component} {name}', value=value)
@@ -1,2 +1,3 @@
 from .last_sales import *
 from .order_info import *
+from .projections import *
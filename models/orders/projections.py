@@ -0,0 +1,46 @@
+from datetime import datetime
+from typing import List
+
+from pydantic import BaseModel, Field
+from pydantic.functional_validators import field_validator
+
+from .order_info import InvoiceState, Option
+
+
+class OrderContentBrief(BaseModel):
+    """Поля заказа, которые нужны для обработки и статистики"""
+    item_id: int = Field(alias="item_id")
+    name: str
+    amount: float
+    currency_type: str = Field(alias="currency_type")
+    invoice_state: InvoiceState = Field(alias="invoice_state")
+    purchase_date: datetime = Field(alias="purchase_date")
+    profit: float
+    options: List[Option]
+
+    @field_validator('purchase_date', mode='before')
+    @classmethod
+    def parse_date(cls, value: str) -> datetime:
+        """Парсинг даты из строки с часовым поясом"""
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+    class Config:
+        populate_by_name = True
+
+
+class OrderBriefResponse(BaseModel):
+    """Проекция ответа с деталями инвойса"""
+    retval: int = None
+    retdesc: str = None
+    content: OrderContentBrief = None
+
+
+class OrderState(BaseModel):
+    invoice_state: InvoiceState = Field(alias="invoice_state")
+
+
+class OrderStateResponse(BaseModel):
+    """Только статус инвойса: по нему выбирается время жизни заказа в кэше"""
+    retval: int = None
+    retdesc: str = None
+    content: OrderState = None
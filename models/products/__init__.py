@@ -1,2 +1,3 @@
 from .all_products import *
 from .product_info import *
+from .projections import *
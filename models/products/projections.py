@@ -0,0 +1,59 @@
+from typing import List, Union
+
+from pydantic import BaseModel
+
+from .product_info import ProductOption
+
+
+# Проекции: только поля, которые читает сервис. Остальные ключи ответа пропускаются при разборе JSON
+# без создания объектов (html-описания, картинки, цены по валютам, хлебные крошки)
+
+
+class ProductBrief(BaseModel):
+    id: int = None
+    name: str = None
+    price: float = None
+    currency: str = None
+
+
+class ProductBriefResponse(BaseModel):
+    retval: int
+    retdesc: str
+    product: ProductBrief
+
+
+class ProductOptions(BaseModel):
+    id: int = None
+    name: str = None
+    options: List[ProductOption] = []
+
+
+class ProductOptionsResponse(BaseModel):
+    retval: int
+    retdesc: str
+    product: ProductOptions
+
+
+class ProductRowBrief(BaseModel):
+    price: Union[float, str]
+    currency: str
+    price_usd: float
+    price_rur: float
+    price_eur: float
+    in_stock: int
+    num_in_stock: int
+    num_options: int
+    id_goods: int
+    name_goods: str
+
+
+class ProductsBriefResponse(BaseModel):
+    retval: int
+    retdesc: str
+    page: int
+    count: int
+    has_next_page: bool
+    has_previous_page: bool
+    total_count: int
+    total_pages: int
+    rows: List[ProductRowBrief]
@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramBadRequest, TelegramForbiddenError
+
+from metrics import TELEGRAM_LATENCY, TELEGRAM_RETRY_AFTER, TELEGRAM_REJECTED, TELEGRAM_ERROR
+from ratelimit import TokenBucket
+from tracing import Tracer, current_invoice
+
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_LIMIT = 4096
+DIGEST_SEPARATOR = '\n\n➖➖➖\n\n'
+
+
+class Notifier:
+    """
+    Очередь исходящих сообщений в Telegram.
+    У каждого чата свой token bucket и свой порядок сообщений, общий bucket держит глобальный лимит бота.
+    На retry_after от Telegram ставятся на паузу и чат, и общий лимит.
+    Если к digest_chat_id накопилось digest_threshold сообщений, они уходят одним сообщением.
+    Сообщения, отправленные при обработке заказа, попадают в его хронологию как спан telegram: от постановки до доставки
+    """
+
+    def __init__(self, bot: Bot, per_chat_rate: float = 1, per_chat_burst: float = 3, global_rate: float = 25,
+                 digest_chat_id: int = None, digest_threshold: int = 5, max_attempts: int = 3,
+                 retry_delay: float = 3, tracer: Tracer = None):
+        self.bot = bot
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        # Без залпа: общий лимит Telegram считается по скользящему окну
+        self.global_bucket = TokenBucket(global_rate, capacity=1)
+        self.digest_chat_id = digest_chat_id
+        self.digest_threshold = digest_threshold
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.tracer = tracer if tracer is not None else Tracer()
+
+        # Текст и (invoice_id, время постановки) заказов, к которым относится сообщение
+        self.pending: dict[int, deque[tuple[str, tuple]]] = {}
+        self.buckets: dict[int, TokenBucket] = {}
+        self.workers: dict[int, asyncio.Task] = {}
+        self.sent = 0
+        self.failed = 0
+        self.retry_after = 0
+        self.digests = 0
+
+    def send(self, chat_id: int, text: str):
+        """Ставит сообщение в очередь и сразу возвращает управление"""
+        invoice_id = current_invoice.get()
+        traces = ((invoice_id, time.time()),) if invoice_id is not None else ()
+        self.pending.setdefault(chat_id, deque()).append((text, traces))
+        if chat_id not in self.workers:
+            self.workers[chat_id] = asyncio.create_task(self.worker(chat_id))
+
+    def backlog(self) -> int:
+        return sum(len(messages) for messages in self.pending.values())
+
+    def next_message(self, chat_id: int) -> tuple[str, tuple]:
+        messages = self.pending[chat_id]
+        if chat_id != self.digest_chat_id or len(messages) < self.digest_threshold:
+            return messages.popleft()
+        # Очередь к админу разрослась: склеиваем накопившееся в один дайджест в пределах лимита длины
+        text, traces = messages.popleft()
+        merged = 1
+        while messages and len(text) + len(DIGEST_SEPARATOR) + len(messages[0][0]) <= MESSAGE_LIMIT:
+            next_text, next_traces = messages.popleft()
+            text += DIGEST_SEPARATOR + next_text
+            traces += next_traces
+            merged += 1
+        if merged > 1:
+            self.digests += 1
+        return text, traces
+
+    async def worker(self, chat_id: int):
+        bucket = self.buckets.setdefault(chat_id, TokenBucket(self.per_chat_rate, self.per_chat_burst))
+        messages = self.pending[chat_id]
+        try:
+            while messages:
+                # Токены берем из обоих лимитов одновременно, иначе ожидание общего лимита
+                # сдвигает отправку и сообщения в чат уходят чаще его лимита
+                while (delay := max(bucket.delay(), self.global_bucket.delay())) > 0:
+                    await asyncio.sleep(delay)
+                bucket.try_acquire()
+                self.global_bucket.try_acquire()
+                text, traces = self.next_message(chat_id)
+                await self.deliver(chat_id, text, bucket, traces)
+        finally:
+            del self.workers[chat_id]
+            if not messages:
+                del self.pending[chat_id]
+
+    def trace(self, traces: tuple, error: str = None):
+        for invoice_id, queued_at in traces:
+            self.tracer.record('telegram', queued_at, time.time() - queued_at, invoice_id, error)
+
+    async def deliver(self, chat_id: int, text: str, bucket: TokenBucket, traces: tuple = ()):
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                with TELEGRAM_LATENCY.time():
+                    await self.bot.send_message(chat_id, text)
+                self.sent += 1
+                self.trace(traces)
+                return
+            except TelegramRetryAfter as e:
+                # Флуд-лимит не считается неудачной попыткой
+                self.retry_after += 1
+                TELEGRAM_RETRY_AFTER.inc()
+                bucket.pause(e.retry_after)
+                self.global_bucket.pause(e.retry_after)
+                self.pending[chat_id].appendleft((text, traces))
+                return
+            except (TelegramBadRequest, TelegramForbiddenError):
+                logger.exception('Telegram rejected message to %s', chat_id)
+                TELEGRAM_REJECTED.inc()
+                break
+            except Exception:
+                logger.exception('Failed to send message to %s, attempt %s', chat_id, attempt)
+                TELEGRAM_ERROR.inc()
+                if attempt < self.max_attempts:
+                    await asyncio.sleep(self.retry_delay)
+        self.failed += 1
+        self.trace(traces, 'failed')
+
+    async def close(self, timeout: float = 10):
+        """Дожидается отправки очереди не дольше timeout секунд"""
+        tasks = list(self.workers.values())
+        if not tasks:
+            return
+        done, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'backlog': self.backlog(),
+            'sent': self.sent,
+            'failed': self.failed,
+            'retry_after': self.retry_after,
+            'digests': self.digests,
+        }
@@ -0,0 +1,127 @@
+import logging
+import re
+import time
+
+from cache import TTLCache
+from ggsel import GGSel
+from models import ProductOption, ProductOptionsResponse
+from resilience import CircuitOpenError, UpstreamError
+
+
+logger = logging.getLogger(__name__)
+
+EMAIL_PATTERN = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+NOT_EMPTY_PATTERN = re.compile(r'\S')
+
+# Текстовые поля проверяются регуляркой, поля с вариантами - по множеству допустимых значений
+TEXT_PATTERNS = {
+    'text': EMAIL_PATTERN,
+    'textarea': NOT_EMPTY_PATTERN,
+}
+VARIANT_TYPES = {'radio', 'select', 'checkbox'}
+
+
+class OptionSchema:
+    """Скомпилированная схема опций товара: обязательные id, допустимые варианты и регулярки полей"""
+
+    def __init__(self, required: frozenset[int], variants: dict[int, frozenset[int]],
+                 patterns: dict[int, re.Pattern], strict: bool = True):
+        self.required = required
+        self.variants = variants
+        self.patterns = patterns
+        # Нестрогая схема пропускает незнакомые опции, используется, когда схему товара не удалось загрузить
+        self.strict = strict
+        self.loaded_at = time.monotonic()
+
+    @classmethod
+    def compile(cls, options: list[ProductOption]) -> 'OptionSchema':
+        required = set()
+        variants = {}
+        patterns = {}
+        for option in options:
+            if option.required:
+                required.add(option.name)
+            if option.type in VARIANT_TYPES:
+                variants[option.name] = frozenset(variant.value for variant in option.variants
+                                                  if variant.visible != 0)
+            else:
+                patterns[option.name] = TEXT_PATTERNS.get(option.type, NOT_EMPTY_PATTERN)
+        return cls(frozenset(required), variants, patterns)
+
+    def validate(self, options: list) -> str | None:
+        """Возвращает текст ошибки или None, если опции заказа подходят под схему"""
+        seen = set()
+        for option in options:
+            seen.add(option.id)
+            allowed = self.variants.get(option.id)
+            if allowed is not None:
+                try:
+                    value = int(option.value)
+                except ValueError:
+                    return 'invalid option'
+                if value not in allowed:
+                    return 'invalid option'
+                continue
+            pattern = self.patterns.get(option.id)
+            if pattern is None:
+                if self.strict:
+                    return 'unknown option'
+                if option.type != 'text':
+                    continue
+                pattern = EMAIL_PATTERN
+            if not pattern.search(str(option.value)):
+                return 'invalid email' if pattern is EMAIL_PATTERN else 'invalid option'
+        if not self.required <= seen:
+            return 'missing option'
+        return None
+
+
+LOOSE_SCHEMA = OptionSchema(frozenset(), {}, {}, strict=False)
+
+
+class OptionValidator:
+    """
+    Проверка опций заказа по схеме товара. Схема собирается из карточки товара один раз
+    и живет в кэше, повторные /check по тому же товару не ходят в GGSel.
+    Если схема из кэша старше refresh_interval секунд отклоняет заказ, она перезагружается один раз:
+    продавец мог добавить опцию или вариант
+    """
+
+    def __init__(self, ggsel: GGSel, size: int = 1024, ttl: float = 3600, refresh_interval: float = 30):
+        self.ggsel = ggsel
+        self.schemas = TTLCache(maxsize=size, ttl=ttl)
+        self.refresh_interval = refresh_interval
+        self.refreshes = 0
+
+    async def load(self, product_id: int) -> OptionSchema:
+        response = await self.ggsel.fetch_product_info(product_id, projection=ProductOptionsResponse)
+        return OptionSchema.compile(response.product.options)
+
+    async def get(self, product_id: int) -> OptionSchema:
+        try:
+            return await self.schemas.get_or_load(product_id, lambda: self.load(product_id))
+        except (UpstreamError, CircuitOpenError):
+            # Без схемы не блокируем покупку, проверяем только почту, как раньше
+            logger.warning('Option schema for product %s is unavailable, using loose validation', product_id)
+            return LOOSE_SCHEMA
+
+    async def validate(self, product_id: int, options: list) -> str | None:
+        requested_at = time.monotonic()
+        schema = await self.get(product_id)
+        error = schema.validate(options)
+        # Схему, загруженную в этом же запросе или только что, не перезагружаем:
+        # иначе каждый заказ с ошибкой в опциях стоил бы запроса в GGSel
+        if error is not None and schema.strict and requested_at - schema.loaded_at > self.refresh_interval:
+            self.refreshes += 1
+            self.schemas.invalidate(product_id)
+            error = (await self.get(product_id)).validate(options)
+        return error
+
+    def invalidate(self, product_id: int = None):
+        if product_id is None:
+            self.schemas.clear()
+        else:
+            self.schemas.invalidate(product_id)
+
+    def stats(self) -> dict[str, int]:
+        return {**self.schemas.stats(), 'refreshes': self.refreshes}
@@ -0,0 +1,108 @@
+import logging
+import math
+
+from pydantic import BaseModel
+from sqlalchemy.dialects.postgresql import insert
+
+from cache import TTLCache
+from database import OrderInfo, now
+from ggsel import GGSel, Response
+from models import InvoiceState, OrderContentBrief, OrderInfoResponse, OrderStateResponse
+
+
+logger = logging.getLogger(__name__)
+
+# В этих статусах нужные нам поля заказа больше не меняются
+TERMINAL_STATES = {InvoiceState.COMPLETED, InvoiceState.CANCELLED, InvoiceState.RETURNED}
+
+
+class OrderCache:
+    """
+    Детали инвойсов GGSel в два уровня: разобранные ответы в памяти (LRU) и исходный JSON в таблице order_info.
+    Завершенные, отмененные и возвращенные заказы хранятся бессрочно, остальные - ttl секунд
+    """
+
+    def __init__(self, ggsel: GGSel, size: int = 4096, ttl: float = 60):
+        self.ggsel = ggsel
+        self.ttl = ttl
+        self.memory = TTLCache(maxsize=size, ttl=ttl, ttl_for=self.ttl_for)
+        self.db_hits = 0
+        self.fetches = 0
+        self.db_errors = 0
+
+    def ttl_for(self, response: BaseModel) -> float:
+        content = getattr(response, 'content', None)
+        return self.state_ttl(content.invoice_state if content is not None else None)
+
+    def state_ttl(self, state: int | None) -> float:
+        return math.inf if state in TERMINAL_STATES else self.ttl
+
+    async def get(self, invoice_id: int, projection: type[Response] = OrderInfoResponse) -> Response:
+        return await self.memory.get_or_load(
+            (invoice_id, projection), lambda: self.load(invoice_id, projection))
+
+    async def load(self, invoice_id: int, projection: type[Response]) -> Response:
+        return projection.model_validate_json(await self.load_raw(invoice_id))
+
+    async def load_raw(self, invoice_id: int) -> str:
+        try:
+            row = await OrderInfo.get(invoice_id)
+        except Exception:
+            # Без базы заказ все равно можно получить из GGSel
+            self.db_errors += 1
+            logger.exception('Failed to read cached order %s', invoice_id)
+            row = None
+        if row is not None:
+            age = (now() - row.fetched_at).total_seconds()
+            if age < self.state_ttl(row.state):
+                self.db_hits += 1
+                return row.raw
+        return await self.fetch(invoice_id)
+
+    async def fetch(self, invoice_id: int) -> str:
+        raw = await self.ggsel.fetch_order_info(invoice_id)
+        self.fetches += 1
+        content = OrderStateResponse.model_validate_json(raw).content
+        if content is not None:
+            await self.store(invoice_id, content.invoice_state, raw)
+        return raw
+
+    async def refresh(self, invoice_id: int, projection: type[Response] = OrderInfoResponse) -> Response:
+        """Перечитывает заказ из GGSel мимо обоих уровней, например чтобы увидеть возврат завершенного заказа"""
+        self.invalidate(invoice_id)
+        return projection.model_validate_json(await self.fetch(invoice_id))
+
+    async def store(self, invoice_id: int, state: int, raw: str):
+        values = {'state': state, 'raw': raw, 'fetched_at': now()}
+        try:
+            await insert(OrderInfo.__table__).values(invoice_id=invoice_id, **values).on_conflict_do_update(
+                index_elements=['invoice_id'], set_=values,
+            ).gino.status()
+        except Exception:
+            self.db_errors += 1
+            logger.exception('Failed to store order %s', invoice_id)
+
+    def invalidate(self, invoice_id: int):
+        # Следующий get перечитает заказ из order_info, а если запись там устарела - из GGSel
+        self.memory.invalidate_matching(lambda key: key[0] == invoice_id)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            **self.memory.stats(),
+            'db_hits': self.db_hits,
+            'fetches': self.fetches,
+            'db_errors': self.db_errors,
+        }
+
+
+def format_order(invoice_id: int, order: OrderContentBrief | None) -> str:
+    if order is None:
+        return f'🧾 Заказ {invoice_id} не найден'
+    text = (f'🧾 Заказ {invoice_id}\n\n'
+            f'Товар: {order.name} ({order.item_id})\n'
+            f'Сумма: {order.amount:g} {order.currency_type}, прибыль {order.profit:g}\n'
+            f'Статус: {order.invoice_state.name}\n'
+            f'Дата: {order.purchase_date.astimezone(now().tzinfo):%d.%m.%Y %H:%M}\n')
+    for option in order.options:
+        text += f'• {option.name}: {option.user_data}\n'
+    return text
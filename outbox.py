@@ -0,0 +1,190 @@
+import asyncio
+import datetime
+import logging
+
+from sqlalchemy import or_
+
+from cluster import Cluster
+from database import db, BuyerMessages, MessageStatus, now
+from ggsel import GGSel
+from ratelimit import TokenBucket
+from resilience import RejectedError
+from supervisor import Supervisor
+from tracing import Tracer
+
+
+logger = logging.getLogger(__name__)
+
+# Первое неотправленное сообщение каждого инвойса, если его еще никто не отправляет и подошло время попытки.
+# Повторная проверка status в UPDATE не дает двум процессам взять одно сообщение
+CLAIM_MESSAGES = db.text("""
+    UPDATE buyer_messages SET status = :sending, claimed_by = :instance_id, attempts = attempts + 1
+    WHERE id IN (
+        SELECT id FROM (
+            SELECT DISTINCT ON (invoice_id) id, status, next_attempt_at FROM buyer_messages
+            WHERE status IN (:pending, :sending)
+            ORDER BY invoice_id, id
+        ) AS heads
+        WHERE status = :pending AND next_attempt_at <= now()
+        ORDER BY id
+        LIMIT :limit
+    ) AND status = :pending
+    RETURNING id, invoice_id, text, attempts
+""")
+
+
+class Outbox:
+    """
+    Очередь сообщений покупателям в чат заказа (debates/v2) поверх таблицы buyer_messages.
+    Сообщение сохраняется до отправки, сообщения одного инвойса уходят строго по порядку,
+    разные инвойсы - параллельно в слотах supervisor вида kind и в пределах общего rate.
+    Ошибки связи повторяются с экспоненциальной задержкой, отказ GGSel сразу помечает сообщение FAILED
+    """
+
+    def __init__(self, ggsel: GGSel, cluster: Cluster, supervisor: Supervisor, kind: str = 'buyer_message',
+                 rate: float = 2, max_attempts: int = 5, retry_delay: float = 5, max_retry_delay: float = 300,
+                 poll_interval: float = 1, recovery_interval: float = 60, tracer: Tracer = None):
+        self.ggsel = ggsel
+        self.cluster = cluster
+        self.supervisor = supervisor
+        self.kind = kind
+        self.bucket = TokenBucket(rate, capacity=1)
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.poll_interval = poll_interval
+        self.recovery_interval = recovery_interval
+        # Без своего tracer спаны только копятся в кольцевом буфере
+        self.tracer = tracer if tracer is not None else Tracer()
+        self.wakeup = asyncio.Event()
+        self.task: asyncio.Task = None
+        self.recovery: asyncio.Task = None
+        self.queued = 0
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.recovered = 0
+
+    async def send(self, invoice_id: int, text: str) -> int:
+        """Сохраняет сообщение в очередь и возвращает его id, отправка идет в фоне"""
+        message = await BuyerMessages.create(invoice_id=invoice_id, text=text, status=MessageStatus.PENDING,
+                                             attempts=0, next_attempt_at=now(), created_at=now())
+        self.queued += 1
+        self.tracer.mark('buyer_message_queued', invoice_id)
+        self.wakeup.set()
+        return message.id
+
+    async def history(self, invoice_id: int) -> list[BuyerMessages]:
+        return await BuyerMessages.query.where(BuyerMessages.invoice_id == invoice_id).order_by(
+            BuyerMessages.id).gino.all()
+
+    async def claim(self, limit: int) -> list:
+        return await db.all(CLAIM_MESSAGES.bindparams(
+            sending=int(MessageStatus.SENDING), pending=int(MessageStatus.PENDING),
+            instance_id=self.cluster.instance_id, limit=limit,
+        ))
+
+    async def set_status(self, message_id: int, status: MessageStatus, **values):
+        await BuyerMessages.update.values(status=status, claimed_by=None, **values).where(
+            BuyerMessages.id == message_id).gino.status()
+
+    async def deliver(self, message_id: int, invoice_id: int, text: str, attempts: int):
+        await self.bucket.acquire()
+        try:
+            with self.tracer.span('buyer_message', invoice_id):
+                await self.ggsel.send_message(invoice_id, text)
+        except RejectedError as e:
+            logger.error('GGSel rejected message %s to invoice %s: %s', message_id, invoice_id, e)
+            self.failed += 1
+            await self.set_status(message_id, MessageStatus.FAILED, error=str(e))
+        except Exception as e:
+            if attempts >= self.max_attempts:
+                logger.exception('Failed to send message %s to invoice %s, giving up', message_id, invoice_id)
+                self.failed += 1
+                await self.set_status(message_id, MessageStatus.FAILED, error=repr(e))
+            else:
+                delay = min(self.retry_delay * 2 ** (attempts - 1), self.max_retry_delay)
+                logger.warning('Failed to send message %s to invoice %s, retry in %.0f s', message_id, invoice_id,
+                               delay)
+                self.retried += 1
+                await self.set_status(message_id, MessageStatus.PENDING, error=repr(e),
+                                      next_attempt_at=now() + datetime.timedelta(seconds=delay))
+        else:
+            self.sent += 1
+            await self.set_status(message_id, MessageStatus.SENT, error=None, sent_at=now())
+        # Следующее сообщение этого инвойса стало первым в очереди
+        self.wakeup.set()
+
+    async def run(self):
+        while True:
+            await self.supervisor.wait_free(self.kind)
+            self.wakeup.clear()
+            if not self.cluster.joined():
+                # Соединение кластера потеряно: взятое сейчас сообщение лидер вернул бы в очередь второму процессу
+                await asyncio.sleep(self.poll_interval)
+                continue
+            task_kind = self.supervisor.kinds[self.kind]
+            try:
+                messages = await self.claim(task_kind.concurrency - task_kind.running - task_kind.waiting)
+            except Exception:
+                logger.exception('Failed to claim buyer messages')
+                messages = []
+            for message in messages:
+                self.supervisor.spawn(self.kind, self.deliver(*message))
+            if not messages:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def recover(self) -> int:
+        # Сообщения, которые отправляли остановившиеся процессы, возвращаются в очередь
+        instances = await self.cluster.instances()
+        _, rows = await BuyerMessages.update.values(status=MessageStatus.PENDING, claimed_by=None).where(
+            BuyerMessages.status == MessageStatus.SENDING
+        ).where(
+            or_(BuyerMessages.claimed_by.is_(None), BuyerMessages.claimed_by.notin_(instances))
+        ).returning(BuyerMessages.id).gino.status()
+        if rows:
+            self.recovered += len(rows)
+            logger.warning('Returned %s buyer messages of stopped instances to the queue', len(rows))
+            self.wakeup.set()
+        return len(rows)
+
+    async def run_recovery(self):
+        while True:
+            try:
+                await self.recover()
+            except Exception:
+                logger.exception('Failed to recover buyer messages')
+            await asyncio.sleep(self.recovery_interval)
+
+    def start_recovery(self):
+        if self.recovery is None or self.recovery.done():
+            self.recovery = asyncio.create_task(self.run_recovery())
+
+    async def stop_recovery(self):
+        if self.recovery is not None:
+            self.recovery.cancel()
+            await asyncio.gather(self.recovery, return_exceptions=True)
+            self.recovery = None
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        # Начатые отправки дорабатывают в supervisor.drain, остальное отправят после перезапуска
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'queued': self.queued,
+            'sent': self.sent,
+            'retried': self.retried,
+            'failed': self.failed,
+            'recovered': self.recovered,
+        }
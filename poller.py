@@ -0,0 +1,80 @@
+import asyncio
+import logging
+
+from sqlalchemy import func
+
+from database import db, Invoices
+from ggsel import GGSel
+from jobs import JobQueue
+
+
+logger = logging.getLogger(__name__)
+
+
+class SalesPoller:
+    """
+    Страховка на случай потерянных или запоздавших вебхуков: опрашивает последние продажи
+    и ставит в очередь заказов те, что новее последнего известного invoice_id.
+    Пока продажи идут, опрос частый, в тишине интервал растет до max_interval
+    """
+
+    def __init__(self, ggsel: GGSel, jobs: JobQueue, min_interval: float = 10, max_interval: float = 120,
+                 top: int = 20):
+        self.ggsel = ggsel
+        self.jobs = jobs
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.top = top
+        self.interval = min_interval
+        self.last_invoice_id: int = None
+        self.task: asyncio.Task = None
+        self.polls = 0
+        self.recovered = 0
+
+    async def poll(self) -> int:
+        response = await self.ggsel.get_last_sales(top=self.top)
+        self.polls += 1
+        sales = sorted(response.sales, key=lambda sale: sale.invoice_id)
+        if self.last_invoice_id is None:
+            last_invoice_id = await db.select([func.max(Invoices.invoice_id)]).gino.scalar()
+            if last_invoice_id is None:
+                # Пустая база: историю не переигрываем, начинаем со следующей продажи
+                last_invoice_id = sales[-1].invoice_id if sales else 0
+            self.last_invoice_id = last_invoice_id
+        new_sales = [sale for sale in sales if sale.invoice_id > self.last_invoice_id]
+        for sale in new_sales:
+            if await self.jobs.enqueue(sale.invoice_id, sale.product.id, durable=True):
+                self.recovered += 1
+                logger.info('Invoice %s picked up from last sales', sale.invoice_id)
+            self.last_invoice_id = sale.invoice_id
+        return len(new_sales)
+
+    async def run(self):
+        while True:
+            try:
+                new_sales = await self.poll()
+            except Exception:
+                logger.exception('Failed to poll last sales')
+                new_sales = 0
+            if new_sales:
+                self.interval = self.min_interval
+            else:
+                self.interval = min(self.interval * 1.5, self.max_interval)
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    def stats(self) -> dict[str, int | float]:
+        return {
+            'polls': self.polls,
+            'recovered': self.recovered,
+            'interval': self.interval,
+        }
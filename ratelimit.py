@@ -0,0 +1,40 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """Ограничитель частоты: rate токенов в секунду, не больше capacity подряд"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Сколько секунд ждать до следующего токена"""
+        self.refill()
+        pause = self.paused_until - time.monotonic()
+        if self.tokens >= 1:
+            return max(pause, 0)
+        return max(pause, (1 - self.tokens) / self.rate)
+
+    def try_acquire(self) -> bool:
+        if self.delay() > 0:
+            return False
+        self.tokens -= 1
+        return True
+
+    async def acquire(self):
+        while not self.try_acquire():
+            await asyncio.sleep(self.delay())
+
+    def pause(self, seconds: float):
+        """Не выдавать токены seconds секунд (retry_after / Retry-After от сервера)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
@@ -0,0 +1,124 @@
+import asyncio
+import datetime
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+from ratelimit import TokenBucket
+
+
+class UpstreamError(Exception):
+    """Ответ, после которого запрос имеет смысл повторить: 429, 5xx или сетевая ошибка"""
+
+    def __init__(self, status: int = None, message: str = '', retry_after: float = None):
+        super().__init__(f'{status}: {message}' if status else message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(Exception):
+    """Upstream считается недоступным, запрос не отправлялся"""
+
+
+class RejectedError(Exception):
+    """Upstream ответил, но отказал (retval != 0), повтор того же запроса не поможет"""
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((date - datetime.datetime.now(datetime.timezone.utc)).total_seconds(), 0)
+
+
+class Limiter:
+    """Не больше concurrency одновременных запросов и rate запросов в секунду"""
+
+    def __init__(self, concurrency: int = 10, rate: float = 10):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.bucket = TokenBucket(rate)
+        self.waits = 0
+
+    async def __aenter__(self):
+        if self.semaphore.locked() or self.bucket.delay() > 0:
+            self.waits += 1
+        await self.semaphore.acquire()
+        try:
+            await self.bucket.acquire()
+        except BaseException:
+            self.semaphore.release()
+            raise
+
+    async def __aexit__(self, *exc):
+        self.semaphore.release()
+
+
+class CircuitBreaker:
+    """
+    После failure_threshold ошибок подряд размыкается и reset_timeout секунд отклоняет запросы сразу.
+    Затем пропускает один пробный запрос: успех замыкает цепь, ошибка снова размыкает
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.opened = 0
+        self.rejected = 0
+
+    def check(self):
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+        if self.state == self.CLOSED:
+            return
+        if self.state == self.HALF_OPEN and not self.probing:
+            self.probing = True
+            return
+        self.rejected += 1
+        raise CircuitOpenError('GGSel is unavailable')
+
+    def cancel_probe(self):
+        # Пробный запрос прервался не из-за upstream, пропускаем следующий
+        self.probing = False
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.opened += 1
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+        self.probing = False
+
+
+class RetryPolicy:
+    """Экспоненциальная задержка с полным джиттером, Retry-After сервера имеет приоритет"""
+
+    def __init__(self, attempts: int = 3, base_delay: float = 0.5, max_delay: float = 10):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int, retry_after: float = None) -> float:
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self.base_delay * 2 ** attempt, self.max_delay))
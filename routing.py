@@ -0,0 +1,99 @@
+import asyncio
+import logging
+
+from sqlalchemy.dialects.postgresql import insert
+
+from database import db, GameRoutes, Products, now
+
+
+logger = logging.getLogger(__name__)
+
+game_codes = {
+    'clash of clans': 'magic',
+    'clash royale': 'scroll',
+    'brawl stars': 'laser'
+}
+
+_MISSING = object()
+
+
+def match_game(name: str) -> str | None:
+    name = name.lower()
+    for game, code in game_codes.items():
+        if game in name:
+            return code
+    return None
+
+
+class Router:
+    """
+    Таблица product_id -> код игры. Собирается из каталога по названиям товаров,
+    ручные привязки из game_routes важнее названия. Перестраивается периодически и по запросу,
+    None - игра не определена, заказ идет на ручную выдачу
+    """
+
+    def __init__(self, interval: float = 300):
+        self.interval = interval
+        self.routes: dict[int, str | None] = {}
+        self.task: asyncio.Task = None
+        self.reloads = 0
+        self.reloaded_at = None
+
+    async def reload(self) -> int:
+        routes = {}
+        for product_id, name in await db.select([Products.id, Products.name]).gino.all():
+            routes[product_id] = match_game(name or '')
+        for product_id, game in await db.select([GameRoutes.product_id, GameRoutes.game]).gino.all():
+            routes[product_id] = game
+        # Словарь подменяется целиком, обработчики заказов не видят наполовину собранную таблицу
+        self.routes = routes
+        self.reloads += 1
+        self.reloaded_at = now()
+        return len(routes)
+
+    def get(self, product_id: int, name: str) -> str | None:
+        code = self.routes.get(product_id, _MISSING)
+        if code is _MISSING:
+            # Товара не было в каталоге при сборке таблицы
+            code = self.routes[product_id] = match_game(name)
+        return code
+
+    async def set_override(self, product_id: int, game: str | None):
+        if game is not None and game not in game_codes.values():
+            raise ValueError(f'Unknown game code {game}')
+        await insert(GameRoutes.__table__).values(
+            product_id=product_id, game=game, updated_at=now()
+        ).on_conflict_do_update(
+            index_elements=['product_id'],
+            set_={'game': game, 'updated_at': now()},
+        ).gino.status()
+        self.routes[product_id] = game
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.reload()
+            except Exception:
+                logger.exception('Failed to reload game routes')
+
+    async def start(self):
+        try:
+            await self.reload()
+        except Exception:
+            logger.exception('Failed to load game routes')
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'routes': len(self.routes),
+            'manual': sum(code is None for code in self.routes.values()),
+            'reloads': self.reloads,
+        }
@@ -0,0 +1,170 @@
+import asyncio
+import datetime
+import heapq
+import logging
+import time
+from typing import Awaitable, Callable
+
+from sqlalchemy import and_
+
+from database import db, Timers, now
+from supervisor import Supervisor
+
+
+logger = logging.getLogger(__name__)
+
+
+class Scheduler:
+    """
+    Отложенные действия поверх таблицы timers вместо корутин, спящих в asyncio.sleep.
+    В памяти только куча (время, id) ближайших таймеров, аргументы действия лежат в базе.
+    Один цикл ждет ближайший таймер и запускает действия в слотах supervisor вида kind.
+    Перед запуском таймер переносится на lease секунд вперед: это и захват между процессами, и повтор,
+    если процесс упал посреди действия. Таймеры других процессов подгружаются раз в reload_interval
+    """
+
+    def __init__(self, supervisor: Supervisor, kind: str = 'timer', reload_interval: float = 10,
+                 lease: float = 60, max_attempts: int = 5, retry_delay: float = 5, max_retry_delay: float = 300):
+        self.supervisor = supervisor
+        self.kind = kind
+        self.reload_interval = reload_interval
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.actions: dict[str, Callable[..., Awaitable]] = {}
+        self.heap: list[tuple[float, int]] = []
+        self.queued: set[int] = set()
+        self.wakeup = asyncio.Event()
+        self.task: asyncio.Task = None
+        self.scheduled = 0
+        self.fired = 0
+        self.retried = 0
+        self.failed = 0
+
+    def action(self, name: str):
+        """Декоратор корутины, которую можно отложить через schedule(name, ...)"""
+        def decorator(func: Callable[..., Awaitable]):
+            self.actions[name] = func
+            return func
+        return decorator
+
+    def push(self, timer_id: int, run_at: datetime.datetime):
+        if timer_id in self.queued:
+            return
+        self.queued.add(timer_id)
+        heapq.heappush(self.heap, (run_at.timestamp(), timer_id))
+        if self.heap[0][1] == timer_id:
+            # Новый таймер раньше того, которого ждет цикл
+            self.wakeup.set()
+
+    async def schedule(self, action: str, delay: float = 0, **payload) -> int:
+        """Сохраняет действие с аргументами payload (JSON) на выполнение через delay секунд"""
+        if action not in self.actions:
+            raise ValueError(f'Unknown action {action}')
+        run_at = now() + datetime.timedelta(seconds=delay)
+        timer = await Timers.create(action=action, payload=payload, run_at=run_at, attempts=0, failed=False,
+                                    created_at=now())
+        self.scheduled += 1
+        self.push(timer.id, run_at)
+        return timer.id
+
+    async def reload(self) -> int:
+        # Таймеры, которые сработают до следующей подгрузки: свои после перезапуска, чужие и с истекшим lease
+        horizon = now() + datetime.timedelta(seconds=self.reload_interval)
+        rows = await db.select([Timers.id, Timers.run_at]).where(
+            and_(Timers.failed.is_(False), Timers.run_at <= horizon)
+        ).gino.all()
+        for timer_id, run_at in rows:
+            self.push(timer_id, run_at)
+        return len(rows)
+
+    async def claim(self, timer_id: int) -> Timers | None:
+        _, rows = await Timers.update.values(
+            run_at=now() + datetime.timedelta(seconds=self.lease), attempts=Timers.attempts + 1
+        ).where(
+            and_(Timers.id == timer_id, Timers.failed.is_(False), Timers.run_at <= now())
+        ).returning(Timers.action, Timers.payload, Timers.attempts).gino.status()
+        return rows[0] if rows else None
+
+    async def fire(self, timer_id: int):
+        # Пока действие выполняется, таймер остается в queued, и reload не запустит его второй раз
+        try:
+            run_at = await self.attempt(timer_id)
+        finally:
+            self.queued.discard(timer_id)
+        if run_at is not None:
+            self.push(timer_id, run_at)
+
+    async def attempt(self, timer_id: int) -> datetime.datetime | None:
+        """Выполняет действие таймера, возвращает время повтора после ошибки"""
+        timer = await self.claim(timer_id)
+        if timer is None:
+            # Таймер уже выполнил или перенес другой процесс
+            return None
+        action, attempts = timer.action, timer.attempts
+        try:
+            handler = self.actions.get(action)
+            if handler is None:
+                raise ValueError(f'Unknown action {action}')
+            await handler(**timer.payload)
+        except Exception as e:
+            if attempts >= self.max_attempts:
+                logger.exception('Timer %s (%s) failed, giving up', timer_id, action)
+                self.failed += 1
+                await Timers.update.values(failed=True, error=repr(e)).where(Timers.id == timer_id).gino.status()
+                return None
+            delay = min(self.retry_delay * 2 ** (attempts - 1), self.max_retry_delay)
+            logger.warning('Timer %s (%s) failed, retry in %.0f s', timer_id, action, delay, exc_info=True)
+            self.retried += 1
+            run_at = now() + datetime.timedelta(seconds=delay)
+            await Timers.update.values(run_at=run_at, error=repr(e)).where(Timers.id == timer_id).gino.status()
+            return run_at
+        self.fired += 1
+        await Timers.delete.where(Timers.id == timer_id).gino.status()
+        return None
+
+    async def run(self):
+        next_reload = time.time() + self.reload_interval
+        while True:
+            if time.time() >= next_reload:
+                try:
+                    await self.reload()
+                except Exception:
+                    logger.exception('Failed to reload timers')
+                next_reload = time.time() + self.reload_interval
+            self.wakeup.clear()
+            while self.heap and self.heap[0][0] <= time.time() and not self.supervisor.full(self.kind):
+                _, timer_id = heapq.heappop(self.heap)
+                self.supervisor.spawn(self.kind, self.fire(timer_id))
+            if self.heap and self.heap[0][0] <= time.time():
+                await self.supervisor.wait_free(self.kind)
+                continue
+            timeout = next_reload - time.time()
+            if self.heap:
+                timeout = min(timeout, self.heap[0][0] - time.time())
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), max(timeout, 0))
+            except asyncio.TimeoutError:
+                pass
+
+    async def start(self):
+        await self.reload()
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        # Несработавшие таймеры остаются в базе и подгрузятся после перезапуска
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'pending': len(self.heap),
+            'scheduled': self.scheduled,
+            'fired': self.fired,
+            'retried': self.retried,
+            'failed': self.failed,
+        }
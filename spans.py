@@ -0,0 +1,126 @@
+import asyncio
+import datetime
+import logging
+import time
+
+from database import db, connected, Spans, now
+from tracing import Tracer
+
+
+logger = logging.getLogger(__name__)
+
+INSERT_SPANS = db.text("""
+    INSERT INTO spans (invoice_id, stage, started_at, duration_ms, error)
+    SELECT * FROM unnest(CAST(:invoice_ids AS BIGINT[]), CAST(:stages AS VARCHAR[]),
+                         CAST(:started_at AS TIMESTAMPTZ[]), CAST(:durations AS DOUBLE PRECISION[]),
+                         CAST(:errors AS VARCHAR[]))
+""")
+
+STAGE_LATENCIES = db.text("""
+    SELECT stage, count(*) AS spans, count(error) AS errors, avg(duration_ms) AS avg_ms,
+           percentile_cont(0.5) WITHIN GROUP (ORDER BY duration_ms) AS p50_ms,
+           percentile_cont(0.95) WITHIN GROUP (ORDER BY duration_ms) AS p95_ms,
+           max(duration_ms) AS max_ms
+    FROM spans WHERE started_at >= :since
+    GROUP BY stage ORDER BY stage
+""")
+
+
+class SpanStore:
+    """
+    Запись спанов Tracer в таблицу spans: одним INSERT раз в interval секунд
+    или как только в буфере набралось tracer.flush_rows записей. Пока база не подключена, спаны ждут в буфере.
+    Записи старше retention_days удаляются раз в час
+    """
+
+    def __init__(self, tracer: Tracer, interval: float = 1, retention_days: float = 14):
+        self.tracer = tracer
+        self.interval = interval
+        self.retention = datetime.timedelta(days=retention_days)
+        self.lock = asyncio.Lock()
+        self.task: asyncio.Task = None
+        self.closing = False
+        self.pruned_at = 0.0
+        self.flushed = 0
+        self.lost = 0
+
+    async def flush(self) -> int:
+        async with self.lock:
+            if not self.tracer.buffer or not connected():
+                return 0
+            rows = self.tracer.take()
+            try:
+                await db.status(INSERT_SPANS.bindparams(
+                    invoice_ids=[row[0] for row in rows],
+                    stages=[row[1] for row in rows],
+                    started_at=[datetime.datetime.fromtimestamp(row[2], datetime.timezone.utc) for row in rows],
+                    durations=[row[3] * 1000 for row in rows],
+                    errors=[row[4] for row in rows],
+                ))
+            except BaseException:
+                # Трассировка не важнее заказов: пачку не возвращаем, чтобы не вытеснять новые спаны
+                self.lost += len(rows)
+                raise
+            self.flushed += len(rows)
+            return len(rows)
+
+    async def prune(self):
+        await Spans.delete.where(Spans.started_at < now() - self.retention).gino.status()
+
+    async def run(self):
+        while not self.closing:
+            try:
+                await asyncio.wait_for(self.tracer.full.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.tracer.full.clear()
+            try:
+                await self.flush()
+                if connected() and time.monotonic() - self.pruned_at > 3600:
+                    self.pruned_at = time.monotonic()
+                    await self.prune()
+            except Exception:
+                logger.exception('Failed to write spans')
+
+    async def timeline(self, invoice_id: int) -> list[dict]:
+        """Этапы заказа по времени: записанные в базу и еще лежащие в буфере"""
+        spans = [
+            {'stage': row.stage, 'started_at': row.started_at, 'duration_ms': row.duration_ms, 'error': row.error}
+            for row in await Spans.query.where(Spans.invoice_id == invoice_id).gino.all()
+        ]
+        spans += [
+            {'stage': stage, 'started_at': datetime.datetime.fromtimestamp(started_at, datetime.timezone.utc),
+             'duration_ms': duration * 1000, 'error': error}
+            for _, stage, started_at, duration, error in self.tracer.buffered(invoice_id)
+        ]
+        spans.sort(key=lambda span: span['started_at'])
+        for span in spans:
+            span['offset_ms'] = (span['started_at'] - spans[0]['started_at']).total_seconds() * 1000
+        return spans
+
+    async def stage_latencies(self, since: datetime.datetime) -> list[dict]:
+        rows = await db.all(STAGE_LATENCIES.bindparams(since=since))
+        return [dict(row.items()) for row in rows]
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.closing = False
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.closing = True
+            self.tracer.full.set()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception('Failed to write spans')
+
+    def stats(self) -> dict[str, int]:
+        return {
+            **self.tracer.stats(),
+            'flushed': self.flushed,
+            'lost': self.lost,
+        }
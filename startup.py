@@ -0,0 +1,92 @@
+import asyncio
+import logging
+import random
+from typing import Awaitable, Callable
+
+
+logger = logging.getLogger(__name__)
+
+
+class Step:
+    def __init__(self, name: str, start: Callable[[], Awaitable], stop: Callable[[], Awaitable] | None,
+                 requires: tuple[str, ...], after: tuple[str, ...], timeout: float):
+        self.name = name
+        self.start = start
+        self.stop = stop
+        self.requires = requires
+        self.after = after
+        self.timeout = timeout
+        self.done = asyncio.Event()
+        self.task: asyncio.Task = None
+        self.status = 'pending'
+        self.attempts = 0
+
+
+class Startup:
+    """
+    Запуск зависимостей сервиса в фоне. Шаги идут параллельно, каждый после шагов из requires
+    (шаги из after ждутся не дольше их таймаута), с таймаутом на попытку и повторами с экспоненциальной задержкой, пока не получится.
+    Пока шаги не завершены, сервис уже принимает запросы. Остановка - в обратном порядке добавления
+    """
+
+    def __init__(self, retry_delay: float = 1, max_retry_delay: float = 30):
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.steps: dict[str, Step] = {}
+
+    def add(self, name: str, start: Callable[[], Awaitable], stop: Callable[[], Awaitable] = None,
+            requires: tuple[str, ...] = (), after: tuple[str, ...] = (), timeout: float = 10):
+        self.steps[name] = Step(name, start, stop, requires, after, timeout)
+
+    async def run_step(self, step: Step):
+        for name in step.requires:
+            step.status = f'waiting for {name}'
+            await self.steps[name].done.wait()
+        for name in step.after:
+            step.status = f'waiting for {name}'
+            try:
+                await asyncio.wait_for(self.steps[name].done.wait(), self.steps[name].timeout)
+            except asyncio.TimeoutError:
+                logger.warning('Startup step %s goes on without %s', step.name, name)
+        delay = self.retry_delay
+        while True:
+            step.attempts += 1
+            try:
+                await asyncio.wait_for(step.start(), step.timeout)
+            except asyncio.TimeoutError:
+                step.status = f'timeout after {step.timeout:.0f} s'
+            except Exception as e:
+                step.status = f'error: {e!r}'
+            else:
+                step.status = 'ok'
+                step.done.set()
+                logger.info('Startup step %s is done after %s attempts', step.name, step.attempts)
+                return
+            logger.warning('Startup step %s failed (%s), retry in %.0f s', step.name, step.status, delay)
+            await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+            delay = min(delay * 2, self.max_retry_delay)
+
+    def start(self):
+        for step in self.steps.values():
+            if step.task is None:
+                step.task = asyncio.create_task(self.run_step(step))
+
+    async def stop(self):
+        pending = [step.task for step in self.steps.values() if step.task is not None and not step.task.done()]
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        for step in reversed(self.steps.values()):
+            step.task = None
+            if not step.done.is_set() or step.stop is None:
+                continue
+            try:
+                await step.stop()
+            except Exception:
+                logger.exception('Failed to stop %s', step.name)
+
+    def ready(self, *names: str) -> bool:
+        return all(self.steps[name].done.is_set() for name in names or self.steps)
+
+    def status(self) -> dict[str, str]:
+        return {name: step.status for name, step in self.steps.items()}
@@ -0,0 +1,146 @@
+import asyncio
+import functools
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Coroutine
+
+from metrics import background_tasks
+
+
+logger = logging.getLogger(__name__)
+
+
+class Overloaded(Exception):
+    """Очередь задач этого вида заполнена, клиенту стоит повторить позже"""
+
+    def __init__(self, kind: str, retry_after: float):
+        super().__init__(f'Backlog of {kind} tasks is full')
+        self.kind = kind
+        self.retry_after = retry_after
+
+
+class TaskKind:
+    def __init__(self, name: str, concurrency: int, backlog: int = None):
+        self.name = name
+        self.concurrency = concurrency
+        # Сколько задач может ждать свободного слота, None - без ограничения
+        self.backlog = backlog
+        self.slots = asyncio.Semaphore(concurrency)
+        self.running = 0
+        self.waiting = 0
+        self.freed = asyncio.Event()
+        self.gauge = background_tasks(name)
+        self.started = 0
+        self.failed = 0
+
+    def full(self) -> bool:
+        return self.running + self.waiting >= self.concurrency
+
+    def overloaded(self) -> bool:
+        return self.backlog is not None and self.waiting >= self.backlog
+
+
+class Supervisor:
+    """
+    Фоновые задачи по видам: у каждого вида свой лимит одновременных задач и ограниченная очередь ожидания.
+    Ошибки задач логируются и сохраняются, при остановке работающие задачи дорабатывают до дедлайна
+    """
+
+    def __init__(self, retry_after: float = 30, error_log: int = 50):
+        self.retry_after = retry_after
+        self.kinds: dict[str, TaskKind] = {}
+        self.tasks: set[asyncio.Task] = set()
+        self.errors: deque[tuple[float, str, str]] = deque(maxlen=error_log)
+        self.closing = False
+
+    def register(self, kind: str, concurrency: int, backlog: int = None):
+        self.kinds[kind] = TaskKind(kind, concurrency, backlog)
+
+    def full(self, kind: str) -> bool:
+        return self.kinds[kind].full()
+
+    async def wait_free(self, kind: str):
+        """Ждет, пока у вида освободится слот"""
+        task_kind = self.kinds[kind]
+        while task_kind.full():
+            task_kind.freed.clear()
+            await task_kind.freed.wait()
+
+    async def run(self, kind: str, awaitable: Awaitable):
+        task_kind = self.kinds[kind]
+        if task_kind.overloaded():
+            raise Overloaded(kind, self.retry_after)
+        task_kind.waiting += 1
+        return await self.execute(task_kind, awaitable)
+
+    async def execute(self, task_kind: TaskKind, awaitable: Awaitable):
+        # Задача уже учтена в waiting вызывающим
+        try:
+            await task_kind.slots.acquire()
+        finally:
+            task_kind.waiting -= 1
+        task_kind.running += 1
+        task_kind.started += 1
+        try:
+            with task_kind.gauge.track_inprogress():
+                return await awaitable
+        finally:
+            task_kind.running -= 1
+            task_kind.slots.release()
+            task_kind.freed.set()
+
+    def limited(self, kind: str):
+        """Декоратор корутины: вызов занимает слот вида, лишние вызовы ждут"""
+        def decorator(func: Callable[..., Coroutine]):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                return await self.run(kind, func(*args, **kwargs))
+            return wrapper
+        return decorator
+
+    def spawn(self, kind: str, coro: Coroutine) -> asyncio.Task:
+        """Запускает задачу в фоне. Overloaded, если очередь вида заполнена или сервис останавливается"""
+        task_kind = self.kinds[kind]
+        if self.closing or task_kind.overloaded():
+            coro.close()
+            raise Overloaded(kind, self.retry_after)
+        # Задача ждет слота с момента создания, а не с первого шага: иначе full() не видит ее,
+        # и цикл, запускающий задачи до заполнения слотов, создаст их все разом
+        task_kind.waiting += 1
+        task = asyncio.create_task(self.guard(kind, coro))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def guard(self, kind: str, coro: Coroutine):
+        try:
+            await self.execute(self.kinds[kind], coro)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.kinds[kind].failed += 1
+            self.errors.append((time.time(), kind, repr(e)))
+            logger.exception('Background %s task failed', kind)
+
+    async def drain(self, timeout: float):
+        """Перестает принимать задачи и ждет текущие, по дедлайну отменяет оставшиеся"""
+        self.closing = True
+        if not self.tasks:
+            return
+        logger.info('Waiting for %s background tasks', len(self.tasks))
+        _, pending = await asyncio.wait(set(self.tasks), timeout=timeout)
+        if pending:
+            logger.warning('Cancelling %s background tasks after %.0f s', len(pending), timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def stats(self) -> dict[str, int]:
+        stats = {}
+        for name, task_kind in self.kinds.items():
+            stats[f'{name}_running'] = task_kind.running
+            stats[f'{name}_waiting'] = task_kind.waiting
+            stats[f'{name}_started'] = task_kind.started
+            stats[f'{name}_failed'] = task_kind.failed
+        return stats
@@ -0,0 +1,84 @@
+import asyncio
+import contextlib
+import functools
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Callable, Coroutine
+
+
+# Заказ, который обрабатывает текущая задача: спаны без явного invoice_id относятся к нему
+current_invoice: ContextVar[int | None] = ContextVar('current_invoice', default=None)
+
+
+class Tracer:
+    """
+    Хронология обработки заказа: спаны этапов с привязкой к invoice_id.
+    Спаны копятся в кольцевом буфере на size записей (при переполнении теряются самые старые),
+    в базу их пишет SpanStore, набралось flush_rows записей - full будит его раньше срока.
+    Модуль не зависит от базы и настроек, его можно подключать в бенчмарках
+    """
+
+    def __init__(self, size: int = 10000, flush_rows: int = 500):
+        self.buffer: deque[tuple[int, str, float, float, str | None]] = deque(maxlen=size)
+        self.flush_rows = flush_rows
+        self.full = asyncio.Event()
+        self.recorded = 0
+        self.dropped = 0
+
+    def bind(self, invoice_id: int):
+        """Привязывает спаны текущей задачи и запущенных из нее задач к заказу"""
+        current_invoice.set(invoice_id)
+
+    def record(self, stage: str, started_at: float, duration: float, invoice_id: int = None, error: str = None):
+        if invoice_id is None:
+            invoice_id = current_invoice.get()
+            if invoice_id is None:
+                return
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1
+        self.buffer.append((invoice_id, stage, started_at, duration, error))
+        self.recorded += 1
+        if len(self.buffer) >= self.flush_rows:
+            self.full.set()
+
+    def mark(self, stage: str, invoice_id: int = None):
+        """Событие без длительности, например получение уведомления"""
+        self.record(stage, time.time(), 0, invoice_id)
+
+    @contextlib.contextmanager
+    def span(self, stage: str, invoice_id: int = None):
+        started_at, start = time.time(), time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            self.record(stage, started_at, time.perf_counter() - start, invoice_id, error)
+
+    def traced(self, stage: str):
+        """Декоратор корутины: ее вызов - спан stage текущего заказа"""
+        def decorator(func: Callable[..., Coroutine]):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with self.span(stage):
+                    return await func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def take(self) -> list[tuple[int, str, float, float, str | None]]:
+        rows = list(self.buffer)
+        self.buffer.clear()
+        return rows
+
+    def buffered(self, invoice_id: int) -> list[tuple[int, str, float, float, str | None]]:
+        return [row for row in list(self.buffer) if row[0] == invoice_id]
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'buffered': len(self.buffer),
+            'recorded': self.recorded,
+            'dropped': self.dropped,
+        }
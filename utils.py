@@ -1,5 +1,6 @@
 import asyncio
 import hmac
+import logging
 import base64
 import urllib
 import uuid
@@ -10,8 +11,14 @@ from typing import Literal
 import aiohttp
 from aiohttp_socks import ProxyConnector
 
-from loader import bot, ggsel
-from config import CAPTCHA_TOKEN, ADMIN_ID, PROXY_IP, PROXY_PORT, PROXY_TYPE, PROXY_USER, PROXY_PASSWORD
+from database import InvoiceStatus
+from loader import ggsel, catalog, notifier, orders, outbox, router, sales, scheduler, supervisor, tracer
+from models import ProductBriefResponse, OrderBriefResponse, OrderContentBrief
+from metrics import verification_code
+from config import CAPTCHA_TOKEN, CAPTCHA_API_URL, SUPERCELL_ID_URL, ADMIN_ID, BUYER_MESSAGE_DELAY, PROXY_IP, PROXY_PORT, PROXY_TYPE, PROXY_USER, PROXY_PASSWORD
+
+
+logger = logging.getLogger(__name__)
 
 
 games_data = {
@@ -55,6 +62,7 @@ def sign(timestamp: int, path: str, method: str, body: str, headers: dict[str, s
     return f"RFPv1 Timestamp={timestamp},SignedHeaders={headers_str},Signature={xb}"
 
 
+@tracer.traced('captcha')
 async def solve_captcha(game: str) -> str:
     data = {
         "clientKey": CAPTCHA_TOKEN,
@@ -72,7 +80,7 @@ async def solve_captcha(game: str) -> str:
         }
     }
     async with aiohttp.ClientSession() as session:
-        response = await session.post("https://api.nextcaptcha.com/createTask", json=data)
+        response = await session.post(f"{CAPTCHA_API_URL}/createTask", json=data)
         data = await response.json()
         task_id = data["taskId"]
     await asyncio.sleep(5)
@@ -82,7 +90,7 @@ async def solve_captcha(game: str) -> str:
             "taskId": task_id
         }
         async with aiohttp.ClientSession() as session:
-            response = await session.post("https://api.nextcaptcha.com/getTaskResult", json=data)
+            response = await session.post(f"{CAPTCHA_API_URL}/getTaskResult", json=data)
             data = await response.json()
             if data['status'] != 'processing':
                 token = data.get('solution').get('gRecaptchaResponse')
@@ -94,27 +102,30 @@ async def solve_captcha(game: str) -> str:
 
 
 async def send_message(chat_id: int, text: str):
-    for _ in range(3):
-        try:
-            await bot.send_message(chat_id, text)
-            return
-        except:
-            await asyncio.sleep(3)
+    # Отправка идет через очередь с лимитами Telegram, здесь не ждем доставки
+    notifier.send(chat_id, text)
+
+
+@scheduler.action('buyer_message')
+async def send_buyer_message(invoice_id: int, text: str):
+    await outbox.send(invoice_id, text)
 
 
+@tracer.traced('verification')
+@supervisor.limited('verification')
 async def send_verification_code(email: str, game: Literal['scroll', 'laser', 'magic'], id_i: int):
     assert game in ('scroll', 'laser', 'magic')
     try:
         solution = await solve_captcha(game)
-    except:
-        await asyncio.sleep(15)
-        await ggsel.send_message(id_i,
-                                 f'Здравствуйте! К сожалению, нам не удалось сформировать запрос на отправку кода :(\n'
-                                 f'Подождите ответа продавца')
-        await bot.send_message(ADMIN_ID, 'Капча не создана')
+    except Exception:
+        await scheduler.schedule('buyer_message', BUYER_MESSAGE_DELAY, invoice_id=id_i,
+                                 text=f'Здравствуйте! К сожалению, нам не удалось сформировать запрос на отправку кода :(\n'
+                                      f'Подождите ответа продавца')
+        verification_code(game, 'captcha_failed')
+        await send_message(ADMIN_ID, 'Капча не создана')
         return
     ts = int(time.time())
-    host = "https://id.supercell.com"
+    host = SUPERCELL_ID_URL
     path = "/api/account/v2/pinAuthentication.start"
     body = urllib.parse.urlencode({
         'scope': 'account/connect',
@@ -139,20 +150,82 @@ async def send_verification_code(email: str, game: Literal['scroll', 'laser', 'm
     # subprocess.run(['systemctl', 'restart', 'tor'])
     # await asyncio.sleep(1)
     # connector = ProxyConnector.from_url('socks5://127.0.0.1:9050')
-    async with aiohttp.ClientSession() as session:
-        async with session.post(f"{host}{path}", headers={k.lower(): v for k, v in headers.items()},
-                                data=body) as response:
-            data = await response.json()
+    with tracer.span('supercell_pin'):
+        async with aiohttp.ClientSession() as session:
+            async with session.post(f"{host}{path}", headers={k.lower(): v for k, v in headers.items()},
+                                    data=body) as response:
+                data = await response.json()
     if data.get('ok') is True:
-        await asyncio.sleep(15)
-        await ggsel.send_message(id_i,
-                           f'Здравствуйте! На указанную вами почту «{email}» автоматически был отправлен код для входа в игру.\n'
-                           f'Отправьте его в чат, в ближайшее время оператор зайдет в аккаунт и доставит товар.\n'
-                           f'Если код не пришел, напишите в чате, отправим вручную повторно')
-        await bot.send_message(ADMIN_ID, 'Код успешно отправлен')
+        await scheduler.schedule('buyer_message', BUYER_MESSAGE_DELAY, invoice_id=id_i,
+                                 text=f'Здравствуйте! На указанную вами почту «{email}» автоматически был отправлен код для входа в игру.\n'
+                                      f'Отправьте его в чат, в ближайшее время оператор зайдет в аккаунт и доставит товар.\n'
+                                      f'Если код не пришел, напишите в чате, отправим вручную повторно')
+        verification_code(game, 'sent')
+        await send_message(ADMIN_ID, 'Код успешно отправлен')
     else:
-        await asyncio.sleep(15)
-        await ggsel.send_message(id_i,
-                                 f'Здравствуйте! К сожалению, нам не удалось сформировать запрос на отправку кода :(\n'
-                                 f'Подождите ответа продавца')
-        await bot.send_message(ADMIN_ID, 'Суперы забраковали')
+        await scheduler.schedule('buyer_message', BUYER_MESSAGE_DELAY, invoice_id=id_i,
+                                 text=f'Здравствуйте! К сожалению, нам не удалось сформировать запрос на отправку кода :(\n'
+                                      f'Подождите ответа продавца')
+        verification_code(game, 'rejected')
+        await send_message(ADMIN_ID, 'Суперы забраковали')
+
+
+@tracer.traced('get_product')
+async def get_product(product_id: int) -> tuple[str, float | str]:
+    # Сначала локальный каталог, затем пакетный products/list, полная карточка только если товара нет в списке
+    product = await catalog.get(product_id)
+    if product is not None:
+        return product.name, product.price
+    row = await ggsel.get_product_row(product_id)
+    if row is not None:
+        await catalog.store_row(row)
+        return row.name_goods, row.price
+    item = await ggsel.get_product_info(product_id, projection=ProductBriefResponse)
+    return item.product.name, item.product.price
+
+
+async def get_product_prices(product_id: int) -> tuple[float | None, float | None, float | None]:
+    # Цены в рублях, долларах и евро для статистики, товар к этому моменту уже в каталоге после get_product
+    product = await catalog.get(product_id)
+    if product is not None:
+        return product.price_rub, product.price_usd, product.price_eur
+    row = await ggsel.get_product_row(product_id)
+    if row is not None:
+        return row.price_rur, row.price_usd, row.price_eur
+    return None, None, None
+
+
+@tracer.traced('record_sale')
+async def record_sale(id_i: int, id_d: int, order: OrderContentBrief):
+    # Ошибка статистики не должна останавливать выдачу заказа
+    try:
+        await sales.record(id_i, order, await get_product_prices(id_d))
+    except Exception:
+        logger.exception('Failed to record sale %s', id_i)
+
+
+@tracer.traced('process_order')
+async def process_order(id_i: int, id_d: int) -> InvoiceStatus:
+    # Спаны этого заказа, в том числе отправленных из него сообщений, попадут в его хронологию
+    tracer.bind(id_i)
+    name, price = await get_product(id_d)
+    code = router.get(id_d, name)
+    reply = f'🛒 Афигеть! Какой-то кельпастник оплатил товар! Выдай ему\n\n'
+    if code is None:
+        reply += '✋ Игра для товара не определена, код не отправляется, выдай вручную\n\n'
+    reply += (f'Товар: {name}\n'
+              f'Стоимость: {price}\n\n')
+    with tracer.span('get_order_info'):
+        order = await orders.get(id_i, projection=OrderBriefResponse)
+    reply += '⚙️ Параметры заказа:\n'
+    email = None
+    for option in order.content.options:
+        reply += f'• {option.name}: {option.user_data}\n'
+        if 'id' in option.name.lower():
+            email = option.user_data
+    await send_message(ADMIN_ID, reply)
+    await record_sale(id_i, id_d, order.content)
+    if code is None:
+        return InvoiceStatus.MANUAL
+    await send_verification_code(email, code, id_i)
+    return InvoiceStatus.DONE